@@ -1,30 +1,28 @@
 # api/generate_puzzle.py
 from http.server import BaseHTTPRequestHandler
-from urllib.parse import urlparse, parse_qs
-from mirrorMazeSolver import generate_puzzle
-import json
+from puzzleService import respond
 
 
 class handler(BaseHTTPRequestHandler):
-    def do_GET(self):
-        # List of allowed origins
-        allowed_origins = ['https://portfolio-eric-lin.vercel.app', 'https://portfolio-eric-lin-git-dev-games-chuan-che-lins-projects.vercel.app', 'http://localhost:3000']
-
-        # Get the origin of the incoming request
-        origin = self.headers.get('Origin')
-
-        query_components = parse_qs(urlparse(self.path).query)
-        height = int(query_components.get('height', [5])[0])
-        width = int(query_components.get('width', [5])[0])
-
-        puzzle_data = generate_puzzle(height, width)
-
-        self.send_response(200)
-        self.send_header('Content-Type', 'application/json')
-
-        # Check if the origin is in our list of allowed origins
-        if origin in allowed_origins:
-            self.send_header('Access-Control-Allow-Origin', origin)
+    """
+    The endpoint as Vercel runs it, one request per thread with the puzzles generated on it. Everything but the HTTP
+    itself is in puzzleService, see puzzleAsgi for the concurrent server.
+    """
+    # chunked transfer (for ?count=) needs HTTP/1.1, so every other response sends its Content-Length
+    protocol_version = 'HTTP/1.1'
 
+    def do_GET(self):
+        response = respond(self.path, self.headers)
+        self.send_response(response.status)
+        for name, value in response.headers:
+            self.send_header(name, value)
+        if response.chunks is None:
+            self.end_headers()
+            self.wfile.write(response.body)
+            return
+        self.send_header('Transfer-Encoding', 'chunked')
         self.end_headers()
-        self.wfile.write(json.dumps(puzzle_data).encode())
+        for chunk in response.chunks:
+            self.wfile.write(b'%X\r\n%s\r\n' % (len(chunk), chunk))
+            self.wfile.flush()
+        self.wfile.write(b'0\r\n\r\n')
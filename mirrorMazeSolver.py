@@ -1,25 +1,311 @@
 """
 Copyright Chuan-Che (Eric) Lin.
+
+Generating and solving a puzzle only needs the standard library, so the API can start without loading NumPy. Grids
+are lists of rows (NumPy arrays work too), and NumPy is imported by the batch features that need it
+(PathTable.incidence() and the methods built on it). The same goes for multiprocessing and the parallel generators.
 """
 
-import numpy as np
+from __future__ import annotations
+
+import logging
+import os
 import random
+from array import array
+from collections import OrderedDict
+from contextlib import nullcontext
+from functools import lru_cache
+from itertools import repeat
+from time import perf_counter
+
+from puzzleSymmetry import canonical_key
+
+TYPE_CHECKING = False  # typing.TYPE_CHECKING without importing typing
+if TYPE_CHECKING:
+    import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# how many times the generator changes one monster of an ambiguous candidate before drawing a new one
+MAX_REPAIRS = 32
+# the search backend (see SEARCH_BACKENDS) of the generator's uniqueness checks
+GENERATION_BACKEND = "bitset"
+
+# difficulty levels, graded by how much the uniqueness check had to search (see grade_difficulty())
+DIFFICULTIES = ("easy", "medium", "hard")
+MEDIUM_MAX_BACKTRACKS = 10
+# search limits that cut a candidate off as soon as it is clearly harder than the level asks for
+DIFFICULTY_LIMITS = {"easy": {"depth_limit": 0}, "medium": {"backtrack_limit": MEDIUM_MAX_BACKTRACKS}, "hard": {}}
+
+# how many layouts known to have a unique solution are remembered (the oldest go first), by canonical key, see
+# MirrorMazeSolver.is_unique()
+UNIQUE_CACHE_SIZE = 4096
+# canonical key -> None, the layouts some search proved unique (a set that keeps its order)
+_unique_layouts = OrderedDict()
+
+# candidate domains are bitmasks over the three monsters
+MONSTER_BITS = {"Z": 1, "V": 2, "G": 4}
+BIT_MONSTERS = {1: "Z", 2: "V", 4: "G"}
+POPCOUNT = (0, 1, 1, 2, 1, 2, 2, 3)
+# the monsters seen by a path through a cell, before (False) and after (True) a mirror
+VISIBLE_BITS = {False: MONSTER_BITS["Z"] | MONSTER_BITS["V"], True: MONSTER_BITS["Z"] | MONSTER_BITS["G"]}
+# int.bit_count() is only there from Python 3.10
+popcount = getattr(int, "bit_count", None) or (lambda num: bin(num).count("1"))
+
+
+class SolveStats:
+    """
+    Opt-in counters and per-phase timers of the solver and the generator. Pass one to MirrorMazeSolver or
+    generate_puzzle() and read it afterwards, the same object can collect over many runs. Without one, NO_STATS is
+    used, whose methods do nothing.
+    >>> stats = SolveStats()
+    >>> with stats.phase("search"):
+    ...     stats.count("nodes", 3)
+    >>> stats.counts, list(stats.seconds)
+    ({'nodes': 3}, ['search'])
+    """
+
+    __slots__ = ("counts", "seconds")
+
+    def __init__(self):
+        self.counts = {}  # name -> num
+        self.seconds = {}  # phase -> total seconds spent in it
+
+    def count(self, name: str, num: int = 1) -> None:
+        self.counts[name] = self.counts.get(name, 0) + num
+
+    def phase(self, name: str):
+        """
+        :return: a context manager that adds the time spent in it to seconds[name]
+        """
+        return _PhaseTimer(self.seconds, name)
+
+    def update(self, other: SolveStats) -> None:
+        """
+        Add the counts and the times of other, like the stats collected in a worker process.
+        """
+        for name, num in other.counts.items():
+            self.count(name, num)
+        for name, sec in other.seconds.items():
+            self.seconds[name] = self.seconds.get(name, 0.0) + sec
+
+    def as_dict(self) -> dict:
+        return {"counts": dict(self.counts), "ms": {name: 1000 * sec for name, sec in self.seconds.items()}}
+
+    def server_timing(self) -> str:
+        """
+        :return: the phases as the value of a Server-Timing header, the counts go in the descriptions
+        >>> stats = SolveStats()
+        >>> stats.seconds["search"] = 0.0125
+        >>> stats.count("attempts", 4)
+        >>> stats.server_timing()
+        'search;dur=12.5, attempts;desc="4"'
+        """
+        timings = [f"{name};dur={1000 * sec:.1f}" for name, sec in self.seconds.items()]
+        timings += [f'{name};desc="{num}"' for name, num in self.counts.items()]
+        return ", ".join(timings)
+
+
+class _PhaseTimer:
+
+    __slots__ = ("seconds", "name", "start")
+
+    def __init__(self, seconds: dict, name: str):
+        self.seconds, self.name = seconds, name
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.seconds[self.name] = self.seconds.get(self.name, 0.0) + perf_counter() - self.start
+
+
+class _NoStats(SolveStats):
+    """
+    Stands in for a missing SolveStats, so the instrumented code doesn't need to check for one.
+    """
+
+    _nothing = nullcontext()
+
+    def count(self, name: str, num: int = 1) -> None:
+        pass
+
+    def phase(self, name: str):
+        return self._nothing
+
+
+NO_STATS = _NoStats()
+
+
+class PathTable:
+    """
+    Every path of a grid, in the order of ["top", "left", "bottom", "right"], stored flat: path i goes through the
+    empty cells cell_list[offset_list[i]:offset_list[i + 1]] (flat ids, x * width + y), and mirror_list tells whether
+    the light had already hit a mirror at that cell. The table is shared between solvers of the same grid, so it must
+    not be changed. cells, mirrored and offsets are the same data as read-only NumPy arrays, made on first use.
+    """
+
+    __slots__ = ("height", "width", "cell_list", "mirror_list", "offset_list", "_arrays", "_incidence")
+
+    def __init__(self, height: int, width: int, cells: list, mirrored: list, offsets: list):
+        self.height, self.width = height, width
+        self.cell_list, self.mirror_list, self.offset_list = cells, mirrored, offsets
+        self._arrays = None
+        self._incidence = None
+
+    def arrays(self) -> tuple:
+        """
+        :return: (cells, mirrored, offsets) as read-only NumPy arrays
+        """
+        if self._arrays is None:
+            import numpy as np
+            self._arrays = (np.array(self.cell_list, dtype=np.intp), np.array(self.mirror_list, dtype=bool),
+                            np.array(self.offset_list, dtype=np.intp))
+            for arr in self._arrays:
+                arr.flags.writeable = False
+        return self._arrays
+
+    @property
+    def cells(self) -> np.ndarray:
+        return self.arrays()[0]
+
+    @property
+    def mirrored(self) -> np.ndarray:
+        return self.arrays()[1]
+
+    @property
+    def offsets(self) -> np.ndarray:
+        return self.arrays()[2]
+
+    def __len__(self) -> int:
+        return len(self.offset_list) - 1
+
+    def path(self, i: int) -> list:
+        """
+        :return: path i in the [(x, y), mirror_status] format of MirrorMazeSolver.all_path
+        """
+        start, end = self.offset_list[i], self.offset_list[i + 1]
+        return [[divmod(cell, self.width), mirror_status]
+                for cell, mirror_status in zip(self.cell_list[start:end], self.mirror_list[start:end])]
+
+    def visible_counts(self, codes: list) -> list:
+        """
+        Count the monsters seen along every path, see visible_counts_batch() for many assignments at once.
+        :param codes: flat list with the monster bit (see MONSTER_BITS) of every cell, anything else for mirrors
+        :return: list with the count for each path
+        >>> trace_paths([[0, 2], [0, 0]]).visible_counts([4, 0, 2, 1])
+        [1, 0, 1, 2, 1, 2, 0, 2]
+        """
+        cells, mirrored, offsets = self.cell_list, self.mirror_list, self.offset_list
+        counts = []
+        for i in range(len(offsets) - 1):
+            count = 0
+            for k in range(offsets[i], offsets[i + 1]):
+                if codes[cells[k]] & VISIBLE_BITS[mirrored[k]]:
+                    count += 1
+            counts.append(count)
+        return counts
+
+    def incidence(self) -> tuple:
+        """
+        The paths as matrices of shape (paths, cells): how many times each path passes each cell before a mirror
+        (direct) and after one (mirrored). Built on first use.
+        :return: (direct, mirrored), float32 so the products run on BLAS, the counts are small enough to stay exact
+        >>> direct, mirrored = trace_paths([[0, 2], [0, 0]]).incidence()
+        >>> direct[0].tolist(), mirrored[0].tolist()
+        ([1.0, 0.0, 1.0, 0.0], [0.0, 0.0, 0.0, 0.0])
+        """
+        if self._incidence is None:
+            import numpy as np
+            shape = (len(self), self.height * self.width)
+            rows = np.repeat(np.arange(len(self)), np.diff(self.offsets))
+            direct, mirrored = np.zeros(shape, dtype=np.float32), np.zeros(shape, dtype=np.float32)
+            np.add.at(direct, (rows[~self.mirrored], self.cells[~self.mirrored]), 1)
+            np.add.at(mirrored, (rows[self.mirrored], self.cells[self.mirrored]), 1)
+            direct.flags.writeable = mirrored.flags.writeable = False
+            self._incidence = direct, mirrored
+        return self._incidence
+
+    def visible_counts_batch(self, codes: np.ndarray) -> np.ndarray:
+        """
+        visible_counts() for many assignments at once, with two matrix products.
+        :param codes: array of shape (N, cells), a row per assignment in the format of visible_counts()
+        :return: int array of shape (N, paths)
+        """
+        import numpy as np
+        direct, mirrored = self.incidence()
+        codes = np.asarray(codes)
+        zombie = codes == MONSTER_BITS["Z"]
+        counts = ((zombie | (codes == MONSTER_BITS["V"])).astype(np.float32) @ direct.T +
+                  (zombie | (codes == MONSTER_BITS["G"])).astype(np.float32) @ mirrored.T)
+        return counts.astype(np.int64)
+
+
+def trace_paths(grid: list) -> PathTable:
+    """
+    Trace the light from every border cell through the grid, cached by the grid layout so the same grid is only
+    traced once.
+    :param grid: rows of 0 for empty slots, 1 for mirror "/" and 2 for mirror "\\", a list of lists or a NumPy array
+    :return: the PathTable of the grid
+    >>> table = trace_paths([[0, 2], [0, 0]])
+    >>> table.cell_list, table.offset_list
+    ([0, 2, 0, 3, 2, 3, 2, 0, 3, 0, 3, 2], [0, 2, 2, 4, 6, 8, 10, 10, 12])
+    """
+    return _trace_paths(len(grid), len(grid[0]), bytes(int(elem) for row in grid for elem in row))
+
+
+@lru_cache(maxsize=1024)
+def _trace_paths(height: int, width: int, layout: bytes) -> PathTable:
+    cells, mirrored, offsets = [], [], [0]
+    # every start point and direction (dx, dy), in the sequence of ["top", "left", "bottom", "right"]
+    starts = ([(0, y, 1, 0) for y in range(width)] + [(x, 0, 0, 1) for x in range(height)] +
+              [(height - 1, y, -1, 0) for y in range(width)] + [(x, width - 1, 0, -1) for x in range(height)])
+    for x, y, dx, dy in starts:
+        mirror_status = False
+        while 0 <= x < height and 0 <= y < width:
+            elem = layout[x * width + y]
+            if elem == 1:
+                # mirror "/" turns down into left, right into up and the other way around
+                dx, dy = -dy, -dx
+                mirror_status = True
+            elif elem == 2:
+                # mirror "\" turns down into right, left into up and the other way around
+                dx, dy = dy, dx
+                mirror_status = True
+            else:
+                cells.append(x * width + y)
+                mirrored.append(mirror_status)
+            x += dx
+            y += dy
+        offsets.append(len(cells))
+    return PathTable(height, width, cells, mirrored, offsets)
 
 
 class MirrorMazeSolver:
 
-    def __init__(self, monster_nums: dict, grid: np.ndarray, border_nums: dict = None, solution: np.ndarray = None):
+    def __init__(self, monster_nums: dict, grid: list, border_nums: dict = None, solution: list = None,
+                 stats: SolveStats = None):
         self.monster_nums = monster_nums  # dict store the num for each monster in the sequence of Z, V, G
-        self.grid = grid  # 0 means empty slots, 1 is mirror "/" , 2 is mirror "\"
+        self.grid = grid  # rows where 0 means empty slots, 1 is mirror "/" , 2 is mirror "\" (lists or a NumPy array)
         self.border_nums = border_nums  # the border numbers given by the puzzle
         self.answer_list = []  # ordered and flattened border_nums in the sequence of ["top", "left", "bottom", "right"]
         self.all_path = []  # list of list, every sublist contains a path for each start point(border_num)
         self.empty_slots = []  # ordered list for coordinates of every empty slot
         self.monster_position = {}  # current status for what monster in each slot
         self.monster_position_determined = {}  # monsters determined in advance by solving strategies
-        self.height, self.width = grid.shape
+        self.height, self.width = len(grid), len(grid[0])
         self.final_grid = solution  # when using generator, we got one solution from the generating process
         self.solutions = []  # cumulative solutions for the given puzzle
+        self.cell_paths = {}  # every empty slot to the list of (path index, mirror_status) that pass through it
+        # the counters of the step-by-step search, built by reset_path_counts() the first time a step needs them
+        self.visible_paths = None  # (slot, monster) to the indexes of the paths that would see that monster there
+        self.path_counts = None  # num of monsters we can see along each path so far
+        self.path_unfilled = None  # num of cells along each path that have no monster yet
+        self.changed_slot = None  # the last slot assigned by fill_one_slot() or backtrack()
+        self.paths = None  # the PathTable of the grid, the same paths as all_path in flat arrays
+        self.metrics = {}  # how hard the last find_solutions() had to work, see SearchCore.metrics()
+        self.stats = NO_STATS if stats is None else stats  # opt-in counters and timers, see SolveStats
 
         # for debugging only: check element in each position
         # for i, row in enumerate(grid):
@@ -40,92 +326,27 @@ class MirrorMazeSolver:
                 self.answer_list.append(val)
         # print(self.answer_list)
 
+        # index the paths by the slots they pass through, so one step of the search only touches those paths
+        offsets = self.paths.offset_list
+        for i in range(len(self.paths)):
+            for k in range(offsets[i], offsets[i + 1]):
+                position = divmod(self.paths.cell_list[k], self.width)
+                self.cell_paths.setdefault(position, []).append((i, self.paths.mirror_list[k]))
 
     def path_finder(self) -> None:
         """
         generate the path for each border num, which is also all the path we need to check whether the puzzle is valid
-        or not
+        or not. The tracing itself is done (and cached) by trace_paths()
         :return: None
         >>> puzzle_2x2 = ({"Z": 1, "V": 1, "G": 1}, [[0, 2], [0, 0]], {"top": [1, 0], "left": [1, 2], "bottom": [1, 2], "right": [0, 2]})
-        >>> MS_test = MirrorMazeSolver(puzzle_2x2[0], np.array(puzzle_2x2[1]), puzzle_2x2[2])
+        >>> MS_test = MirrorMazeSolver(puzzle_2x2[0], puzzle_2x2[1], puzzle_2x2[2])
         >>> MS_test.all_path
         [[[(0, 0), False], [(1, 0), False]], [], [[(0, 0), False], [(1, 1), True]], [[(1, 0), False], [(1, 1), False]], [[(1, 0), False], [(0, 0), False]], [[(1, 1), False], [(0, 0), True]], [], [[(1, 1), False], [(1, 0), False]]]
 
         """
-        # dir: WASD for 4 directions
-        all_dim = ["top", "left", "bottom", "right"]
-
-        # every loop is a dimension
-        for cur_dim in all_dim:
-            if cur_dim == "top" or cur_dim == "bottom":
-                length = self.width
-            else:
-                length = self.height
-            # every loop is a path
-            for i in range(length):
-                # initial point and status for each path
-                mirror_status = False
-                cur_path = []
-                if cur_dim == "top":
-                    cur_x, cur_y = 0, i
-                    cur_dir = "S"
-                elif cur_dim == "left":
-                    cur_x, cur_y = i, 0
-                    cur_dir = "D"
-                elif cur_dim == "bottom":
-                    cur_x, cur_y = length - 1, i
-                    cur_dir = "W"
-                elif cur_dim == "right":
-                    cur_x, cur_y = i, length - 1
-                    cur_dir = "A"
-
-                # each time, check if the light already get out of the maze
-                while self.is_inside(cur_x, cur_y):
-                    # add the cur_loc into the path if it is an empty slot
-                    # print(cur_x, cur_y)
-                    if self.grid[(cur_x, cur_y)] == 0:
-                        cur_path.append([(cur_x, cur_y), mirror_status])
-                        if cur_dir == "S":
-                            cur_x += 1
-                        elif cur_dir == "W":
-                            cur_x -= 1
-                        elif cur_dir == "A":
-                            cur_y -= 1
-                        elif cur_dir == "D":
-                            cur_y += 1
-
-                    # turn for two kinds of mirror
-                    elif self.grid[(cur_x, cur_y)] == 1:
-                        mirror_status = True
-                        if cur_dir == "S":
-                            cur_dir = "A"
-                            cur_y -= 1
-                        elif cur_dir == "A":
-                            cur_dir = "S"
-                            cur_x += 1
-                        elif cur_dir == "D":
-                            cur_dir = "W"
-                            cur_x -= 1
-                        elif cur_dir == "W":
-                            cur_dir = "D"
-                            cur_y += 1
-
-                    elif self.grid[(cur_x, cur_y)] == 2:
-                        mirror_status = True
-                        if cur_dir == "S":
-                            cur_dir = "D"
-                            cur_y += 1
-                        elif cur_dir == "D":
-                            cur_dir = "S"
-                            cur_x += 1
-                        elif cur_dir == "W":
-                            cur_dir = "A"
-                            cur_y -= 1
-                        elif cur_dir == "A":
-                            cur_dir = "W"
-                            cur_x -= 1
-
-                self.all_path.append(cur_path)
+        with self.stats.phase("trace"):
+            self.paths = trace_paths(self.grid)
+        self.all_path = [self.paths.path(i) for i in range(len(self.paths))]
 
     def is_inside(self, x, y):
         """
@@ -135,7 +356,7 @@ class MirrorMazeSolver:
         :param y: The y-coordinate of the point.
         :return: True if the point is inside the grid, False otherwise.
         >>> puz_2x2 = ({"Z": 1, "V": 1, "G": 1}, [[0, 2], [0, 0]], {"top": [1, 0], "left": [1, 2], "bottom": [1, 2], "right": [0, 2]})
-        >>> ms = MirrorMazeSolver(puz_2x2[0], np.array(puz_2x2[1]), puz_2x2[2])
+        >>> ms = MirrorMazeSolver(puz_2x2[0], puz_2x2[1], puz_2x2[2])
         >>> ms.is_inside(0, 0)
         True
         >>> ms.is_inside(-1, 0)
@@ -143,23 +364,24 @@ class MirrorMazeSolver:
         >>> ms.is_inside(0, 2)
         False
         """
-        num_rows, num_cols = self.grid.shape
-        return 0 <= x < num_rows and 0 <= y < num_cols
+        return 0 <= x < self.height and 0 <= y < self.width
 
     def deterministic_zero_border_value(self) -> None:
         """
         >>> puz_2x2 = ({"Z": 1, "V": 1, "G": 1}, [[0, 2], [0, 0]], {"top": [1, 0], "left": [0, 2], "bottom": [1, 2], "right": [0, 2]})
-        >>> ms = MirrorMazeSolver(puz_2x2[0], np.array(puz_2x2[1]), puz_2x2[2])
+        >>> ms = MirrorMazeSolver(puz_2x2[0], puz_2x2[1], puz_2x2[2])
         >>> ms.deterministic_zero_border_value()
         >>> print(ms.monster_position_determined)
         {(0, 0): 'G', (1, 1): 'V'}
         """
-        for i in range(len(self.all_path)):
+        offsets = self.paths.offset_list
+        for i in range(len(self.paths)):
             # print(self.all_path[i], self.answer_list[i])
             if self.answer_list[i] == 0:
                 # means that the border value (clue) is zero, so the ones after mirror got to be V, otherwise, G
-                for cell in self.all_path[i]:
-                    position, mirror_status = cell[0], cell[1]
+                for k in range(offsets[i], offsets[i + 1]):
+                    position = divmod(self.paths.cell_list[k], self.width)
+                    mirror_status = self.paths.mirror_list[k]
                     if position not in self.monster_position_determined:
                         # avoid the same position again, it would cause bugs due to the incorrect monster_nums
                         if mirror_status:
@@ -175,15 +397,18 @@ class MirrorMazeSolver:
         / \
         \ Z
         >>> puz_2x2 = ({"Z": 1, "V": 0, "G": 0}, [[1, 2], [2, 0]], {"top": [0, 0], "left": [0, 0], "bottom": [0, 2], "right": [0, 2]})
-        >>> ms = MirrorMazeSolver(puz_2x2[0], np.array(puz_2x2[1]), puz_2x2[2])
+        >>> ms = MirrorMazeSolver(puz_2x2[0], puz_2x2[1], puz_2x2[2])
         >>> ms.deterministic_surrounded_by_mirror()
         >>> print(ms.monster_position_determined)
         {(1, 1): 'Z'}
         """
-        for i in range(len(self.all_path)):
-            if len(self.all_path[i]) == 2 and self.answer_list[i] == 2:
-                if self.all_path[i][0][0] == self.all_path[i][1][0]:
-                    position = self.all_path[i][0][0]
+        cells, mirrored, offsets = self.paths.cell_list, self.paths.mirror_list, self.paths.offset_list
+        for i in range(len(self.paths)):
+            start = offsets[i]
+            if offsets[i + 1] - start == 2 and self.answer_list[i] == 2:
+                # the same cell seen once before and once after a mirror, only a zombie is seen both times
+                if cells[start] == cells[start + 1] and mirrored[start] != mirrored[start + 1]:
+                    position = divmod(cells[start], self.width)
                     if position not in self.monster_position_determined:
                         self.monster_position_determined[position] = "Z"
                         self.monster_nums["Z"] -= 1
@@ -196,27 +421,14 @@ class MirrorMazeSolver:
         :return: True means the maze is full
         the return boolean is used to decide to use check_puzzle() or check_full_puzzle()
         """
-        for i in range(len(self.empty_slots)):
+        # the slots are always filled in the order of empty_slots, so the filled ones are exactly the first ones
+        i = len(self.monster_position)
+        if i < len(self.empty_slots):
             slot = self.empty_slots[i]
-            if slot not in self.monster_position:
-                if self.monster_nums["Z"]:
-                    self.monster_position[slot] = "Z"
-                    self.monster_nums["Z"] -= 1
-                    if i == len(self.empty_slots) - 1:
-                        return True
-                    return False
-                elif self.monster_nums["V"]:
-                    self.monster_position[slot] = "V"
-                    self.monster_nums["V"] -= 1
-                    if i == len(self.empty_slots) - 1:
-                        return True
-                    return False
-                elif self.monster_nums["G"]:
-                    self.monster_position[slot] = "G"
-                    self.monster_nums["G"] -= 1
-                    if i == len(self.empty_slots) - 1:
-                        return True
-                    return False
+            for monster in ("Z", "V", "G"):
+                if self.monster_nums[monster]:
+                    self.place_monster(slot, monster)
+                    return i == len(self.empty_slots) - 1
         return True
 
     def backtrack(self) -> None:
@@ -229,54 +441,147 @@ class MirrorMazeSolver:
         monster type if they still remains.
         AND if we have tried ghost in the last item in monster_position, it suggests that the one before the last
         item is also wrong, so we have to backtrack again.
+        fill_one_slot() and backtrack() step through the search one slot at a time, find_solutions() runs the same
+        search on the compact SearchCore. After either step, check_puzzle(changed_slot) checks the slot it changed.
         :return:
         """
-        if len(self.monster_position) == 0:
-            raise ValueError('Backtracked all the way to beginning. No more solutions.')
-        pos, monster = self.monster_position.popitem()
-        self.monster_nums[monster] += 1
-        if monster == "Z":
-            if self.monster_nums["V"]:
-                self.monster_position[pos] = "V"
-                self.monster_nums["V"] -= 1
-                return
-            elif self.monster_nums["G"]:
-                self.monster_position[pos] = "G"
-                self.monster_nums["G"] -= 1
-                return
-            else:
-                self.backtrack()
-        elif monster == "V":
-            if self.monster_nums["G"]:
-                self.monster_position[pos] = "G"
-                self.monster_nums["G"] -= 1
+        self.ensure_path_counts()
+        while True:
+            if len(self.monster_position) == 0:
+                raise ValueError('Backtracked all the way to beginning. No more solutions.')
+            pos, monster = self.monster_position.popitem()
+            self.monster_nums[monster] += 1
+            self.update_path_counts(pos, monster, -1)
+            if monster == "Z":
+                if self.monster_nums["V"]:
+                    self.place_monster(pos, "V")
+                    return
+                elif self.monster_nums["G"]:
+                    self.place_monster(pos, "G")
+                    return
+            elif monster == "V":
+                if self.monster_nums["G"]:
+                    self.place_monster(pos, "G")
+                    return
+            elif monster != "G":
+                print("Error! Every monster should be Z, V ,or G")
                 return
-            else:
-                self.backtrack()
-        elif monster == "G":
-            self.backtrack()
 
-        else:
-            print("Error! Every monster should be Z, V ,or G")
+    def find_swappable_cells(self, solution_grid: list = None):
+        """
+        Cheap check for a second solution of the solution grid, without searching: two slots whose monsters can be
+        swapped without changing any border number.
+        - two slots passed by exactly the same paths, the same way (before or after a mirror)
+        - a zombie and a vampire in slots only seen before mirrors, both are seen there every time
+        - a zombie and a ghost in slots only seen after mirrors
+        :param solution_grid: grid of "Z", "V", "G" and mirrors, default final_grid
+        :return: the positions of two such slots, None if there are none
+        >>> ms = MirrorMazeSolver({"Z": 1, "V": 1, "G": 0}, [[0, 0]], None, [["Z", "V"]])
+        >>> ms.find_swappable_cells()
+        ((0, 0), (0, 1))
+        """
+        if solution_grid is None:
+            solution_grid = self.final_grid
+        if solution_grid is None:
+            return None
+        by_signature = {}  # the paths through a slot -> monster -> first slot with that monster
+        one_sided = {False: {}, True: {}}  # seen only before / after mirrors -> monster -> first slot
+        for pos, paths in self.cell_paths.items():
+            monster = str(solution_grid[pos[0]][pos[1]])
+            same = by_signature.setdefault(tuple(sorted(paths)), {})
+            for other_monster, other in same.items():
+                if other_monster != monster:
+                    return other, pos
+            same.setdefault(monster, pos)
 
-    def generate_border_nums(self, solution_grid) -> dict:
-        all_num = []
-        for i, path in enumerate(self.all_path):
-            cur_num = 0  # the num of monster we can see along the path
+            statuses = {mirror_status for _, mirror_status in paths}
+            if len(statuses) == 1:
+                status = statuses.pop()
+                hidden_twin = "G" if status else "V"  # the monster seen exactly like a zombie here
+                partner = hidden_twin if monster == "Z" else "Z" if monster == hidden_twin else None
+                if partner in one_sided[status]:
+                    return one_sided[status][partner], pos
+                one_sided[status].setdefault(monster, pos)
+        return None
 
-            if not path:
-                pass
-            else:
-                for e in path:
-                    # e[0] => coordinates, e[1] => mirror_status
-                    monster = solution_grid[e[0]]
-                    if monster == "Z":
-                        cur_num += 1
-                    elif monster == "G" and e[1]:
-                        cur_num += 1
-                    elif monster == "V" and not e[1]:
-                        cur_num += 1
-            all_num.append(cur_num)
+    def place_monster(self, pos: tuple, monster: str) -> None:
+        """
+        Put a monster into an empty slot and keep monster_nums and the per-path counters up to date.
+        :param pos: coordinates of the slot
+        :param monster: "Z", "V" or "G"
+        :return: None
+        """
+        self.ensure_path_counts()
+        self.monster_position[pos] = monster
+        self.monster_nums[monster] -= 1
+        self.update_path_counts(pos, monster, 1)
+        self.changed_slot = pos
+
+    def update_path_counts(self, pos: tuple, monster: str, step: int) -> None:
+        """
+        Update the counters of every path through pos when a monster is put in (step=1) or taken out (step=-1).
+        :return: None
+        """
+        path_counts, path_unfilled = self.path_counts, self.path_unfilled
+        for i in self.visible_paths.get((pos, monster), ()):
+            path_counts[i] += step
+        for i, _ in self.cell_paths.get(pos, ()):
+            path_unfilled[i] -= step
+
+    def reset_path_counts(self) -> None:
+        """
+        Recount every path from scratch using monster_position and monster_position_determined.
+        :return: None
+        >>> puz_2x2 = ({"Z": 1, "V": 1, "G": 1}, [[0, 2], [0, 0]], {"top": [1, 0], "left": [1, 2], "bottom": [1, 2], "right": [0, 2]})
+        >>> ms = MirrorMazeSolver(puz_2x2[0], puz_2x2[1], puz_2x2[2])
+        >>> ms.monster_position_determined[(0, 0)] = "Z"
+        >>> ms.reset_path_counts()
+        >>> ms.path_counts, ms.path_unfilled
+        ([1, 0, 1, 0, 1, 1, 0, 0], [1, 0, 1, 2, 1, 1, 0, 2])
+        """
+        if self.visible_paths is None:
+            self.visible_paths = {}
+            for position, paths in self.cell_paths.items():
+                for monster in ("Z", "V", "G"):
+                    # a zombie is always seen, a ghost only after a mirror and a vampire only before one
+                    self.visible_paths[position, monster] = [i for i, mirror_status in paths
+                                                             if monster == "Z" or (monster == "G") == mirror_status]
+        self.path_counts = [0] * len(self.all_path)
+        self.path_unfilled = [len(path) for path in self.all_path]
+        for placed in (self.monster_position_determined, self.monster_position):
+            for pos, monster in placed.items():
+                self.update_path_counts(pos, monster, 1)
+
+    def ensure_path_counts(self) -> None:
+        """
+        Count every path the first time the step-by-step search needs it, find_solutions() runs on SearchCore and
+        never does.
+        :return: None
+        """
+        if self.path_counts is None:
+            self.reset_path_counts()
+
+    def path_is_possible(self, i: int) -> bool:
+        """
+        A path is still possible when we have not seen more monsters than the clue, and the cells left unfilled can
+        still make up the difference (each of them can add at most one).
+        """
+        self.ensure_path_counts()
+        return self.path_counts[i] <= self.answer_list[i] <= self.path_counts[i] + self.path_unfilled[i]
+
+    def generate_border_nums(self, solution_grid) -> dict:
+        """
+        Count the monsters seen from every border for the solution grid.
+        :param solution_grid: grid of "Z", "V", "G" and mirrors
+        :return: the border numbers in the same format as border_nums
+        >>> puz_2x2 = ({"Z": 1, "V": 1, "G": 1}, [[0, 2], [0, 0]], {"top": [1, 0], "left": [1, 2], "bottom": [1, 2], "right": [0, 2]})
+        >>> ms = MirrorMazeSolver(puz_2x2[0], puz_2x2[1], puz_2x2[2])
+        >>> ms.generate_border_nums([["G", "\\\\"], ["V", "Z"]])
+        {'top': [1, 0], 'left': [1, 2], 'bottom': [1, 2], 'right': [0, 2]}
+        """
+        with self.stats.phase("clues"):
+            codes = [MONSTER_BITS.get(str(elem), 0) for row in solution_grid for elem in row]
+            all_num = self.paths.visible_counts(codes)
 
         border_num = {}
 
@@ -293,75 +598,110 @@ class MirrorMazeSolver:
 
         return border_num
 
-    def check_puzzle(self) -> bool:
+    def assignment_codes(self, solutions: list) -> np.ndarray:
         """
-        This function only check the non-full puzzle.
-        The difference between this and check_full_puzzle() is that this functions check larger than (>) while the
-        check_full_puzzle() needs exact matches on every path.
-
-        :return: True means that every path have exceeded their given value (we kept it in the self.answer_list)
+        :param solutions: dicts of coordinates to monsters, like the ones in self.solutions
+        :return: int8 array of shape (N, cells) with the monster bits (see MONSTER_BITS), 0 for mirrors and gaps
         """
-        for i, path in enumerate(self.all_path):
-            cur_num = 0  # the num of monster we can see along the path, compare this to the answer we have
-            ans = self.answer_list[i]  # the correct number that we should see along this path
+        import numpy as np
+        codes = np.zeros((len(solutions), self.height * self.width), dtype=np.int8)
+        for row, solution in zip(codes, solutions):
+            for (x, y), monster in solution.items():
+                row[x * self.width + y] = MONSTER_BITS[monster]
+        return codes
 
-            if not path:
-                if ans:
-                    return False
-            else:
-                for e in path:
-                    # e[0] => coordinates, e[1] => mirror_status
-                    if e[0] in self.monster_position:
-                        monster = (self.monster_position[e[0]])
-                    elif e[0] in self.monster_position_determined:
-                        monster = (self.monster_position_determined[e[0]])
-                    else:
-                        continue  # means that we haven't filled the slot yet
-                    if monster == "Z":
-                        cur_num += 1
-                    elif monster == "G" and e[1]:
-                        cur_num += 1
-                    elif monster == "V" and not e[1]:
-                        cur_num += 1
-            if cur_num > ans:
-                return False
+    def check_assignments(self, codes: np.ndarray) -> np.ndarray:
+        """
+        Check many full assignments at once against the clues and the monster totals, see
+        PathTable.visible_counts_batch().
+        :param codes: array of shape (N, cells) like the one from assignment_codes()
+        :return: bool array of shape (N,), True for the assignments that solve the puzzle
+        >>> puz_2x2 = ({"Z": 1, "V": 1, "G": 1}, [[0, 2], [0, 0]], {"top": [1, 0], "left": [1, 2], "bottom": [1, 2], "right": [0, 2]})
+        >>> ms = MirrorMazeSolver(dict(puz_2x2[0]), puz_2x2[1], puz_2x2[2])
+        >>> ms.check_assignments(ms.assignment_codes([{(0, 0): "G", (1, 0): "V", (1, 1): "Z"},
+        ...                                          {(0, 0): "V", (1, 0): "G", (1, 1): "Z"}])).tolist()
+        [True, False]
+        """
+        import numpy as np
+        codes = np.asarray(codes)
+        matches = (self.paths.visible_counts_batch(codes) == np.array(self.answer_list)).all(axis=1)
+        # the totals also count the monsters the search or the deterministic strategies have taken out of monster_nums
+        placed = list(self.monster_position.values()) + list(self.monster_position_determined.values())
+        for monster, bit in MONSTER_BITS.items():
+            matches &= (codes == bit).sum(axis=1) == self.monster_nums[monster] + placed.count(monster)
+        return matches
 
-        return True
+    def brute_force_solutions(self, batch: int = 1 << 14) -> list:
+        """
+        Try every assignment of monsters to the empty slots, checked batch by batch with check_assignments(). The
+        work grows as 3 ** slots, so this is meant for verifying the search on small boards.
+        :param batch: num of assignments checked at once
+        :return: every solution, in the format of self.solutions
+        >>> puz_2x2 = ({"Z": 1, "V": 1, "G": 1}, [[0, 2], [0, 0]], {"top": [1, 0], "left": [1, 2], "bottom": [1, 2], "right": [0, 2]})
+        >>> MirrorMazeSolver(dict(puz_2x2[0]), puz_2x2[1], puz_2x2[2]).brute_force_solutions()
+        [{(0, 0): 'G', (1, 0): 'V', (1, 1): 'Z'}]
 
-    def check_full_puzzle(self) -> bool:
+        Both search backends find exactly the solutions this does, on a seeded corpus of random small boards:
+        >>> import random
+        >>> def solved(solutions):
+        ...     return sorted(sorted(solution.items()) for solution in solutions)
+        >>> def search(nums, grid, border_nums, **kwargs):
+        ...     ms = MirrorMazeSolver(dict(nums), grid, border_nums)
+        ...     ms.find_solutions(**kwargs)
+        ...     return solved(ms.solutions)
+        >>> rng, wrong, ambiguous = random.Random(2024), [], 0
+        >>> for k in range(60):
+        ...     grid, solution, nums = random_candidate(rng.randint(2, 4), rng.randint(2, 4), rng)
+        ...     border_nums = MirrorMazeSolver(dict(nums), grid, None, solution).border_nums
+        ...     expected = solved(MirrorMazeSolver(dict(nums), grid, border_nums).brute_force_solutions())
+        ...     ambiguous += len(expected) > 1
+        ...     if any(search(nums, grid, border_nums, **kwargs) != expected
+        ...            for kwargs in ({"backend": "array"}, {"backend": "array", "propagate": True, "det": True},
+        ...                           {"backend": "bitset"}, {"backend": "bitset", "det": True})):
+        ...         wrong.append(k)
+        >>> wrong, ambiguous
+        ([], 5)
         """
-        see check_puzzle()
+        import numpy as np
+        slots = np.flatnonzero(np.asarray(self.grid).ravel() == 0)
+        bits = np.array([MONSTER_BITS["Z"], MONSTER_BITS["V"], MONSTER_BITS["G"]], dtype=np.int8)
+        powers = 3 ** np.arange(len(slots), dtype=np.int64)
+        solutions = []
+        for start in range(0, 3 ** len(slots), batch):
+            index = np.arange(start, min(start + batch, 3 ** len(slots)), dtype=np.int64)
+            codes = np.zeros((len(index), self.height * self.width), dtype=np.int8)
+            codes[:, slots] = bits[index[:, None] // powers % 3]
+            for row in codes[self.check_assignments(codes)]:
+                solutions.append({divmod(int(cell), self.width): BIT_MONSTERS[row[cell]] for cell in slots})
+        return solutions
+
+    def check_puzzle(self, pos: tuple = None) -> bool:
         """
-        for i, path in enumerate(self.all_path):
-            # print(path, self.answer_list[i])
-            # print(path)
-            cur_num = 0  # the num of monster we can see along the path, compare this to the answer we have
-            ans = self.answer_list[i]  # the correct number that we should see along this path
+        This function only check the non-full puzzle.
+        The difference between this and check_full_puzzle() is that this functions only check the bounds of each path
+        (not more monsters than the clue, and enough unfilled cells left to reach it) while the check_full_puzzle()
+        needs exact matches on every path.
 
-            if not path:
-                if ans:
-                    return False
-            else:
-                for e in path:
-                    # e[0] => coordinates, e[1] => mirror_status
-                    if e[0] in self.monster_position:
-                        monster = (self.monster_position[e[0]])
-                    elif e[0] in self.monster_position_determined:
-                        monster = (self.monster_position_determined[e[0]])
-                    else:
-                        raise ValueError("Every empty slot should have a monster in it.")
-
-                    if monster == "Z":
-                        cur_num += 1
-                    elif monster == "G" and e[1]:
-                        cur_num += 1
-                    elif monster == "V" and not e[1]:
-                        cur_num += 1
-            if cur_num != ans:
+        :param pos: only check the paths through this slot, None means check every path
+        :return: True means that no path can be ruled out yet
+        """
+        self.ensure_path_counts()
+        if pos is None:
+            return all(self.path_is_possible(i) for i in range(len(self.all_path)))
+        path_counts, path_unfilled, answer_list = self.path_counts, self.path_unfilled, self.answer_list
+        for i, _ in self.cell_paths.get(pos, ()):
+            if not path_counts[i] <= answer_list[i] <= path_counts[i] + path_unfilled[i]:
                 return False
-
         return True
 
+    def check_full_puzzle(self) -> bool:
+        """
+        see check_puzzle()
+        """
+        self.ensure_path_counts()
+        if any(self.path_unfilled):
+            raise ValueError("Every empty slot should have a monster in it.")
+        return self.path_counts == self.answer_list
 
     def write_answer_puzzle_to_file(self, file_path: str) -> None:
         """
@@ -370,19 +710,19 @@ class MirrorMazeSolver:
         :return: None
         """
         if self.final_grid is None:
-            final_grid = self.grid.astype(str)
+            final_grid = [[str(elem) for elem in row] for row in self.grid]
 
-            for i, row in enumerate(final_grid):
+            for i, row in enumerate(self.grid):
                 for j, elem in enumerate(row):
-                    if elem == "0":
+                    if elem == 0:
                         if (i, j) in self.monster_position:
-                            final_grid[i, j] = str(self.monster_position[(i, j)])
+                            final_grid[i][j] = str(self.monster_position[(i, j)])
                         else:
-                            final_grid[i, j] = str(self.monster_position_determined[(i, j)])
-                    elif elem == "1":
+                            final_grid[i][j] = str(self.monster_position_determined[(i, j)])
+                    elif elem == 1:
                         final_grid[i][j] = "/"
-                    elif elem == "2":
-                        final_grid[i, j] = "\\"
+                    elif elem == 2:
+                        final_grid[i][j] = "\\"
         else:
             final_grid = self.final_grid
 
@@ -390,105 +730,964 @@ class MirrorMazeSolver:
             for row in final_grid:
                 file.write(' '.join(row) + '\n')
 
-    def find_solutions(self, det: bool = False):
+    def find_solutions(self, det: bool = False, limit: int = None, propagate: bool = False, depth_limit: int = None,
+                       backtrack_limit: int = None, backend: str = "array", node_limit: int = None,
+                       deadline: float = None, stop=None):
         """
         Solve the puzzle by brute-force using backtracking.
         :param det: We can choose whether we want to use the deterministic solving strategies or not by changing det
+        :param limit: stop searching as soon as this many solutions have been found, None means find all of them
+        :param propagate: search with constraint propagation (see SearchCore.propagating_search()) instead of plain
+        Z->V->G enumeration
+        :param depth_limit: give up once the search has to branch deeper than this, None means no limit
+        :param backtrack_limit: give up after this many dead ends, None means no limit
+        :param backend: "array" searches on SearchCore, "bitset" on BitsetCore (which always propagates)
+        :param node_limit: give up after putting in this many monsters, None means no limit
+        :param deadline: give up once time.perf_counter() passes this, None means no limit
+        :param stop: optional event (anything with is_set()), give up once it is set
         :return:
         """
         # before generating empty solt, we can eliminate some slots using deterministic solving strategies
         if det:
-            self.deterministic_zero_border_value()
-            self.deterministic_surrounded_by_mirror()
+            with self.stats.phase("rules"):
+                self.deterministic_zero_border_value()
+                self.deterministic_surrounded_by_mirror()
             # print(self.monster_position_determined)
 
         # generate the list of empty slots
+        self.empty_slots = []
         for i, row in enumerate(self.grid):
             for j, elem in enumerate(row):
                 if (i, j) not in self.monster_position_determined and elem == 0:
                     self.empty_slots.append((i, j))
 
+        # the search itself runs on compact array state, see SearchCore
+        with self.stats.phase("search"):
+            core = SEARCH_BACKENDS[backend](self, limit, depth_limit, backtrack_limit, node_limit, deadline, stop)
+            if propagate:
+                core.propagating_search()
+            else:
+                core.enumerate()
+        self.metrics = core.metrics()
+        self.stats.count("searches")
+        self.stats.count("nodes", core.nodes)
+        self.stats.count("backtracks", core.backtracks)
+
+    def count_solutions(self, limit: int = None, det: bool = True, propagate: bool = True, depth_limit: int = None,
+                        backtrack_limit: int = None, backend: str = "array", node_limit: int = None,
+                        deadline: float = None, stop=None) -> int:
+        """
+        Count the solutions of the puzzle, stop as soon as the limit is reached.
+        :param limit: the most solutions we care about, None means count all of them
+        :param det: whether to use the deterministic solving strategies first
+        :param propagate: whether to search with constraint propagation
+        :param depth_limit: see find_solutions()
+        :param backtrack_limit: see find_solutions()
+        :param backend: see find_solutions()
+        :param node_limit: see find_solutions()
+        :param deadline: see find_solutions()
+        :param stop: see find_solutions()
+        :return: the number of solutions found, never larger than limit
+        >>> puz_2x2 = ({"Z": 1, "V": 1, "G": 1}, [[0, 2], [0, 0]], {"top": [1, 0], "left": [1, 2], "bottom": [1, 2], "right": [0, 2]})
+        >>> MirrorMazeSolver(dict(puz_2x2[0]), puz_2x2[1], puz_2x2[2]).count_solutions()
+        1
+        >>> MirrorMazeSolver(dict(puz_2x2[0]), puz_2x2[1], puz_2x2[2]).count_solutions(propagate=False)
+        1
+        >>> MirrorMazeSolver(dict(puz_2x2[0]), puz_2x2[1], puz_2x2[2]).count_solutions(backend="bitset")
+        1
+        """
+        self.solutions = []
+        self.find_solutions(det, limit, propagate, depth_limit, backtrack_limit, backend, node_limit, deadline, stop)
+        return len(self.solutions)
+
+    def is_unique(self, det: bool = True, propagate: bool = True, depth_limit: int = None,
+                  backtrack_limit: int = None, backend: str = "array", node_limit: int = None,
+                  deadline: float = None, cache: bool = True, stop=None) -> bool:
+        """
+        Check whether the puzzle has exactly one solution, the search stops once a second solution shows up.
+        Layouts found unique are remembered by their canonical key, so a rotation or reflection of one of them is not
+        searched again: it gets no solutions, and metrics that count no work and say "cached". How much the search
+        has to work depends on the orientation, so callers that grade the puzzle by its metrics pass cache=False.
+        Checks with a depth_limit or backtrack_limit always search, whether those cut the search off depends on the
+        orientation too. Ambiguous layouts are always searched, the callers need both solutions.
+        :param det: whether to use the deterministic solving strategies first
+        :param propagate: whether to search with constraint propagation
+        :param depth_limit: see find_solutions()
+        :param backtrack_limit: see find_solutions()
+        :param backend: see find_solutions()
+        :param node_limit: see find_solutions()
+        :param deadline: see find_solutions()
+        :param cache: whether to look the layout up and remember it, see above
+        :param stop: see find_solutions()
+        :return: True means the puzzle has one and only one solution, False also when a limit cut the search off
+        >>> puz_2x2 = ({"Z": 1, "V": 1, "G": 1}, [[0, 2], [0, 0]], {"top": [1, 0], "left": [1, 2], "bottom": [1, 2], "right": [0, 2]})
+        >>> MirrorMazeSolver(dict(puz_2x2[0]), puz_2x2[1], puz_2x2[2]).is_unique()
+        True
+        >>> turned = MirrorMazeSolver(dict(puz_2x2[0]), [[0, 0], [2, 0]], {"top": [1, 2], "left": [1, 0], "bottom": [0, 2], "right": [1, 2]})
+        >>> turned.is_unique(), turned.solutions, turned.metrics["cached"], turned.metrics["nodes"]
+        (True, [], True, 0)
+        >>> easy = generate_puzzle(5, 5, seed=3, difficulty="easy")
+        >>> _unique_layouts.clear()
+        >>> def solver():
+        ...     return MirrorMazeSolver(dict(easy["monster_nums"]), easy["grid"], easy["border_nums"])
+        >>> solver().is_unique(propagate=False), solver().is_unique(depth_limit=0)
+        (True, True)
+        """
+        key = self.canonical_key() if cache else None
+        if key in _unique_layouts and depth_limit is None and backtrack_limit is None:
+            self.solutions = []
+            self.metrics = {"determined": 0, "propagated": 0, "nodes": 0, "backtracks": 0, "max_depth": 0,
+                            "cut_off": False, "cached": True}
+            self.stats.count("cached")
+            return True
+        num = self.count_solutions(2, det, propagate, depth_limit, backtrack_limit, backend, node_limit, deadline,
+                                   stop)
+        unique = num == 1 and not self.metrics["cut_off"]
+        if unique and cache:
+            _unique_layouts[key] = None
+            if len(_unique_layouts) > UNIQUE_CACHE_SIZE:
+                _unique_layouts.popitem(last=False)
+        return unique
+
+    def canonical_key(self) -> str:
+        """
+        :return: the key of the puzzle that is the same for all of its rotations and reflections, see puzzleSymmetry
+        """
+        nums = dict(self.monster_nums)
+        for monster in self.monster_position_determined.values():
+            nums[monster] += 1  # the deterministic rules take their monsters out of the totals
+        return canonical_key({"grid": self.grid, "border_nums": self.border_nums, "monster_nums": nums})
+
+
+class SearchCore:
+    """
+    Compact state for searching the solutions of one MirrorMazeSolver. Every cell has a flat id (x * width + y), the
+    monsters are the bits in MONSTER_BITS, and the assignment (or the candidate domains) is an int8 array indexed by
+    the flat id. The search runs as a loop over an explicit stack, so it does not recurse or raise.
+    """
+
+    __slots__ = ("solver", "slots", "nums", "cells", "seen", "hidden", "over", "short", "path_cells", "path_needs",
+                 "slot_paths", "solutions", "limit", "depth_limit", "backtrack_limit", "node_limit", "deadline", "stop",
+                 "nodes", "backtracks", "deepest", "propagated", "cut_off")
+
+    def __init__(self, solver: MirrorMazeSolver, limit: int = None, depth_limit: int = None,
+                 backtrack_limit: int = None, node_limit: int = None, deadline: float = None, stop=None):
+        self.solver = solver
+        self.limit = limit
+        self.depth_limit = depth_limit  # give up when the search has to branch deeper than this
+        self.backtrack_limit = backtrack_limit  # give up after this many dead ends
+        self.node_limit = node_limit  # give up after this many monsters put in
+        self.deadline = deadline  # give up once perf_counter() passes this
+        self.stop = stop  # give up once this event is set
+        self.nodes = 0  # num of monsters put in, the size of the search tree
+        self.backtracks = 0  # num of monsters that broke a path or total right away
+        self.deepest = 0  # the most monsters put in (branched on) at the same time
+        self.propagated = 0  # slots decided by propagation before the first branch
+        self.cut_off = False  # True means a limit stopped the search, so the solutions may be incomplete
+        self.solutions = solver.solutions  # found solutions are appended straight to the solver
+        width = solver.width
+        num_cells = solver.height * width
+        determined = {x * width + y: MONSTER_BITS[monster]
+                      for (x, y), monster in solver.monster_position_determined.items()}
+        self.slots = tuple(x * width + y for x, y in solver.empty_slots)
+        # remaining num of each monster, indexed by its bit
+        self.nums = [0] * 5
+        for monster, bit in MONSTER_BITS.items():
+            self.nums[bit] = solver.monster_nums[monster]
+        self.cells = array("b", bytes(num_cells))
+        for cell, bit in determined.items():
+            self.cells[cell] = bit
+
+        # seen[cell * 8 + bit] / hidden[cell * 8 + bit] are the paths that see / do not see that monster in that cell
+        # (once per time the path passes the cell)
+        self.seen = [()] * (num_cells * 8)
+        self.hidden = [()] * (num_cells * 8)
+        # over[i] is how many more monsters path i may still see, short[i] is how many of its unfilled cells may still
+        # be hidden, the path is broken as soon as either goes below zero
+        self.over = []
+        self.short = []
+        # for the propagating search: the (cell, visible bits) of every unfilled cell on each path, the num of
+        # monsters it still needs to see, and the paths through each cell
+        self.path_cells = []
+        self.path_needs = []
+        self.slot_paths = [()] * num_cells
+        seen, hidden = {}, {}
+        table = solver.paths
+        offsets = table.offset_list
+        for i in range(len(table)):
+            count = unfilled = 0
+            cells = []
+            for k in range(offsets[i], offsets[i + 1]):
+                cell = table.cell_list[k]
+                visible = VISIBLE_BITS[table.mirror_list[k]]
+                if cell in determined:
+                    if determined[cell] & visible:
+                        count += 1
+                    continue
+                unfilled += 1
+                cells.append((cell, visible))
+                if i not in self.slot_paths[cell]:
+                    self.slot_paths[cell] += (i,)
+                for bit in (1, 2, 4):
+                    target = seen if bit & visible else hidden
+                    target.setdefault(cell * 8 + bit, []).append(i)
+            ans = solver.answer_list[i]
+            self.over.append(ans - count)
+            self.short.append(count + unfilled - ans)
+            self.path_cells.append(tuple(cells))
+            self.path_needs.append(ans - count)
+        for key, paths in seen.items():
+            self.seen[key] = tuple(paths)
+        for key, paths in hidden.items():
+            self.hidden[key] = tuple(paths)
+
+    def metrics(self) -> dict:
+        """
+        :return: how much work the search took, together with the slots fixed before it by the deterministic rules
+        """
+        return {
+            "determined": len(self.solver.monster_position_determined),
+            "propagated": self.propagated,
+            "nodes": self.nodes,
+            "backtracks": self.backtracks,
+            "max_depth": self.deepest,
+            "cut_off": self.cut_off,
+        }
+
+    def give_up(self, depth: int) -> bool:
+        """
+        Called at every dead end and every new deepest branch, which can't be more than one slot count of nodes apart.
+        :return: True (and mark the search as cut off) when a limit has been passed
+        """
+        if (self.depth_limit is not None and depth > self.depth_limit or
+                self.backtrack_limit is not None and self.backtracks > self.backtrack_limit or
+                self.node_limit is not None and self.nodes > self.node_limit or
+                self.deadline is not None and perf_counter() > self.deadline or
+                self.stop is not None and self.stop.is_set()):
+            self.cut_off = True
+        return self.cut_off
+
+    def record_solution(self) -> bool:
+        """
+        Add the current full assignment to the solutions as a dict of coordinates to monsters.
+        :return: True means the limit of solutions has been reached and the search should stop
+        """
+        width, cells = self.solver.width, self.cells
+        solution = dict(self.solver.monster_position_determined)
+        for cell in self.slots:
+            solution[divmod(cell, width)] = BIT_MONSTERS[cells[cell]]
+        self.solutions.append(dict(sorted(solution.items())))
+        return self.limit is not None and len(self.solutions) >= self.limit
+
+    def enumerate(self) -> None:
+        """
+        Fill the slots in order, always trying zombie, then vampire, then ghost (only the ones that still remain).
+        Putting a monster in only updates the paths through that cell, and a path is given up once it sees more
+        monsters than its clue or has too few unfilled cells left to reach it.
+        >>> puz_2x2 = ({"Z": 1, "V": 1, "G": 1}, [[0, 2], [0, 0]], {"top": [1, 0], "left": [1, 2], "bottom": [1, 2], "right": [0, 2]})
+        >>> ms = MirrorMazeSolver(dict(puz_2x2[0]), puz_2x2[1], puz_2x2[2])
+        >>> ms.find_solutions()
+        >>> ms.solutions
+        [{(0, 0): 'G', (1, 0): 'V', (1, 1): 'Z'}]
+        """
+        over, short, seen, hidden, nums, cells, slots = (self.over, self.short, self.seen, self.hidden, self.nums,
+                                                          self.cells, self.slots)
+        if min(over, default=0) < 0 or min(short, default=0) < 0 or min(nums) < 0:
+            return
+        next_bit = (1, 2, 4, 0, 0)  # zombie -> vampire -> ghost -> nothing left to try
+        depth, size = 0, len(slots)
+        while depth >= 0:
+            if depth == size:
+                if self.record_solution():
+                    return
+                depth -= 1
+                continue
+            cell = slots[depth]
+            bit = cells[cell]
+            if bit:
+                # take the previous monster out
+                nums[bit] += 1
+                for i in seen[cell * 8 + bit]:
+                    over[i] += 1
+                for i in hidden[cell * 8 + bit]:
+                    short[i] += 1
+            bit = next_bit[bit]
+            while bit and not nums[bit]:
+                bit = next_bit[bit]
+            cells[cell] = bit
+            if not bit:
+                depth -= 1
+                continue
+            nums[bit] -= 1
+            self.nodes += 1
+            possible = True
+            for i in seen[cell * 8 + bit]:
+                over[i] -= 1
+                if over[i] < 0:
+                    possible = False
+            for i in hidden[cell * 8 + bit]:
+                short[i] -= 1
+                if short[i] < 0:
+                    possible = False
+            if possible:
+                depth += 1
+                if depth > self.deepest:
+                    self.deepest = depth
+                    if self.give_up(depth):
+                        return
+            else:
+                self.backtracks += 1
+                if self.give_up(depth):
+                    return
+
+    def propagating_search(self) -> None:
+        """
+        Solve with constraint propagation. Every slot keeps a domain of the monsters it can still be, and after every
+        assignment the domains are narrowed until nothing changes:
+        - each path has a min and max number of monsters it can still see, if the min reaches the clue every undecided
+        cell on it has to be hidden, if the max reaches the clue every undecided cell has to be seen.
+        - each monster type has a total in monster_nums, if the cells that can still be that monster are just enough
+        they all have to be it, if the cells that are already that monster use it up no other cell can be it.
+        Then we branch on the undecided slot with the fewest candidates left.
+        >>> puz_2x2 = ({"Z": 1, "V": 1, "G": 1}, [[0, 2], [0, 0]], {"top": [1, 0], "left": [1, 2], "bottom": [1, 2], "right": [0, 2]})
+        >>> ms = MirrorMazeSolver(dict(puz_2x2[0]), puz_2x2[1], puz_2x2[2])
+        >>> ms.find_solutions(propagate=True)
+        >>> ms.solutions
+        [{(0, 0): 'G', (1, 0): 'V', (1, 1): 'Z'}]
+        """
+        nums, domains, slots, slot_paths = self.nums, self.cells, self.slots, self.slot_paths
+        if min(nums) < 0:
+            return  # the deterministic strategies used more monsters than we have
+        start = 0
+        for bit in (1, 2, 4):
+            if nums[bit]:
+                start |= bit
+        for cell in slots:
+            domains[cell] = start
+        trail = []  # (cell, previous domain) for every change, so a branch can be undone
+        if not self.propagate(range(len(self.path_cells)), trail):
+            return
+        self.propagated = sum(POPCOUNT[domains[cell]] == 1 for cell in slots)
+
+        # the explicit stack: the cell branched on at each depth, the candidates not tried yet, and the trail length
+        # before the branch
+        size = len(slots)
+        stack_cell = array("i", bytes(4 * size))
+        stack_left = array("b", bytes(size))
+        stack_mark = array("i", bytes(4 * size))
+        depth = -1
+        cell = self.pick_cell()
+        while True:
+            if cell == -1:
+                # every slot is decided and every path and total has been checked by propagate()
+                if self.record_solution():
+                    return
+            elif cell >= 0:
+                depth += 1
+                if depth >= self.deepest:
+                    self.deepest = depth + 1
+                    if self.give_up(depth + 1):
+                        return
+                stack_cell[depth] = cell
+                stack_left[depth] = domains[cell]
+                stack_mark[depth] = len(trail)
+            # undo down to the deepest branch that still has a candidate to try
+            while depth >= 0:
+                mark = stack_mark[depth]
+                while len(trail) > mark:
+                    changed, old = trail.pop()
+                    domains[changed] = old
+                if stack_left[depth]:
+                    break
+                depth -= 1
+            if depth < 0:
+                return
+            cell, left = stack_cell[depth], stack_left[depth]
+            bit = left & -left
+            stack_left[depth] = left & ~bit
+            trail.append((cell, domains[cell]))
+            domains[cell] = bit
+            self.nodes += 1
+            # -2 is a dead end: nothing to record or push, go straight to the next candidate
+            if self.propagate(slot_paths[cell], trail):
+                cell = self.pick_cell()
+            else:
+                cell = -2
+                self.backtracks += 1
+                if self.give_up(depth + 1):
+                    return
+
+    def pick_cell(self) -> int:
+        """
+        :return: the undecided slot with the fewest candidates (the one on the most paths among ties), -1 if every
+        slot is decided
+        """
+        domains, slot_paths = self.cells, self.slot_paths
+        best, best_size, best_paths = -1, 4, 0
+        for cell in self.slots:
+            size = POPCOUNT[domains[cell]]
+            if size > 1 and (size < best_size or size == best_size and len(slot_paths[cell]) > best_paths):
+                best, best_size, best_paths = cell, size, len(slot_paths[cell])
+                if size == 2 and best_paths >= 4:
+                    break  # can't do much better than this
+        return best
+
+    def propagate(self, paths, trail: list) -> bool:
+        """
+        Narrow the domains until nothing changes, starting from the given paths.
+        :param paths: indexes of the paths to check first
+        :param trail: every changed domain is recorded here
+        :return: False means some path, monster total or domain cannot be satisfied any more
+        """
+        domains, path_cells, path_needs, slot_paths, nums, slots = (self.cells, self.path_cells, self.path_needs,
+                                                                    self.slot_paths, self.nums, self.slots)
+        queue = list(paths)
+        queued = set(queue)
         while True:
-            try:
-                is_full = self.fill_one_slot()
-                # print(self.monster_position)
-                if self.check_puzzle():
-                    if is_full:
-                        if self.check_full_puzzle():
-                            # print(self.monster_position)
-                            self.solutions.append(self.monster_position)
-                            # print(self.solutions)
-                            # self.write_answer_puzzle_to_file("./answer.txt")
-                        self.backtrack()
+            while queue:
+                i = queue.pop()
+                queued.discard(i)
+                low = high = 0
+                for cell, visible in path_cells[i]:
+                    d = domains[cell]
+                    if d & visible:
+                        high += 1
+                        if not d & ~visible:
+                            low += 1
+                need = path_needs[i]
+                if low > need or high < need:
+                    return False
+                if low == high:
+                    continue
+                if low == need:
+                    keep_visible = False  # the path has seen enough, the undecided cells must be hidden
+                elif high == need:
+                    keep_visible = True  # the path needs every cell it could still see
+                else:
+                    continue
+                for cell, visible in path_cells[i]:
+                    d = domains[cell]
+                    if not d & visible or not d & ~visible:
+                        continue  # already decided for this path
+                    trail.append((cell, d))
+                    domains[cell] = d & visible if keep_visible else d & ~visible
+                    for j in slot_paths[cell]:
+                        if j not in queued:
+                            queued.add(j)
+                            queue.append(j)
+
+            # the monster totals, counted in one pass: fixed[bit] cells are that monster, possible[bit] could be
+            fixed = [0] * 5
+            possible = [0] * 5
+            for cell in slots:
+                d = domains[cell]
+                if d & 1:
+                    possible[1] += 1
+                if d & 2:
+                    possible[2] += 1
+                if d & 4:
+                    possible[4] += 1
+                if POPCOUNT[d] == 1:
+                    fixed[d] += 1
+            narrowed_totals = False
+            for bit in (1, 2, 4):
+                total = nums[bit]
+                if fixed[bit] > total or possible[bit] < total:
+                    return False
+                if fixed[bit] == possible[bit] or total not in (fixed[bit], possible[bit]):
+                    continue
+                for cell in slots:
+                    d = domains[cell]
+                    if d & bit and d != bit:
+                        # either every candidate cell is needed, or the monster is used up elsewhere
+                        trail.append((cell, d))
+                        domains[cell] = bit if possible[bit] == total else d & ~bit
+                        for j in slot_paths[cell]:
+                            if j not in queued:
+                                queued.add(j)
+                                queue.append(j)
+                # the other counts are stale now, let the next round redo them
+                narrowed_totals = True
+                break
+            if not narrowed_totals:
+                return True
+
+
+class BitsetCore(SearchCore):
+    """
+    The same propagating search as SearchCore, with the whole state in three integers: bit k of can[1], can[2] and
+    can[4] tells whether slot k can still be a zombie, a vampire or a ghost. Every path is a set of slot masks, the
+    slots it passes before a mirror (direct) and after one (mirrored), with a second mask for the slots it passes
+    twice, so the min and max number of monsters it can still see are popcounts of ANDed masks, and undoing a branch
+    means putting three integers back.
+    """
+
+    __slots__ = ("masks", "needs", "order", "slot_path_bits", "every")
+
+    def __init__(self, solver: MirrorMazeSolver, limit: int = None, depth_limit: int = None,
+                 backtrack_limit: int = None, node_limit: int = None, deadline: float = None, stop=None):
+        # the base class builds the counters and the per-path cells, the bitsets are made from them
+        super().__init__(solver, limit, depth_limit, backtrack_limit, node_limit, deadline, stop)
+        # number the slots by how many paths pass them, so the lowest bit of a set of candidates is the one on the
+        # most paths
+        self.order = sorted(self.slots, key=lambda cell: -len(self.slot_paths[cell]))
+        bits = {cell: 1 << k for k, cell in enumerate(self.order)}
+        self.every = (1 << len(self.order)) - 1
+        # the paths through each slot, as bits
+        self.slot_path_bits = [sum(1 << i for i in self.slot_paths[cell]) for cell in self.order]
+        # masks[i] is (direct, direct twice, mirrored, mirrored twice) of path i
+        self.masks = []
+        for cells in self.path_cells:
+            direct = twice = mirrored = mirrored_twice = 0
+            for cell, visible in cells:
+                bit = bits[cell]
+                if visible == VISIBLE_BITS[False]:
+                    twice |= direct & bit
+                    direct |= bit
                 else:
-                    self.backtrack()
-            except ValueError as ex:
-                if ex.args[0] == 'Backtracked all the way to beginning. No more solutions.':
+                    mirrored_twice |= mirrored & bit
+                    mirrored |= bit
+            self.masks.append((direct, twice, mirrored, mirrored_twice))
+        self.needs = self.path_needs
+
+    def enumerate(self) -> None:
+        """
+        The bitset search always propagates, there is no plain enumeration on this state.
+        """
+        self.propagating_search()
+
+    def record_solution(self, can: list = None) -> bool:
+        width = self.solver.width
+        solution = dict(self.solver.monster_position_determined)
+        for k, cell in enumerate(self.order):
+            for bit in (1, 2, 4):
+                if can[bit] >> k & 1:
+                    solution[divmod(cell, width)] = BIT_MONSTERS[bit]
+        self.solutions.append(dict(sorted(solution.items())))
+        return self.limit is not None and len(self.solutions) >= self.limit
+
+    def propagating_search(self) -> None:
+        """
+        >>> puz_2x2 = ({"Z": 1, "V": 1, "G": 1}, [[0, 2], [0, 0]], {"top": [1, 0], "left": [1, 2], "bottom": [1, 2], "right": [0, 2]})
+        >>> ms = MirrorMazeSolver(dict(puz_2x2[0]), puz_2x2[1], puz_2x2[2])
+        >>> ms.find_solutions(propagate=True, backend="bitset")
+        >>> ms.solutions
+        [{(0, 0): 'G', (1, 0): 'V', (1, 1): 'Z'}]
+        """
+        if min(self.nums) < 0:
+            return
+        every = self.every
+        can = [0, every if self.nums[1] else 0, every if self.nums[2] else 0, 0, every if self.nums[4] else 0]
+        if not self.propagate(can, 0, (1 << len(self.masks)) - 1):
+            return
+        z, v, g = can[1], can[2], can[4]
+        self.propagated = popcount(every & ~(z & v | z & g | v & g))
+
+        # the stack holds, for every branch, the state before it, the slot bit and the candidates not tried yet
+        stack = []
+        while True:
+            z, v, g = can[1], can[2], can[4]
+            undecided = z & v | z & g | v & g
+            if not undecided:
+                if self.record_solution(can):
+                    return
+            else:
+                # the slots with two candidates first, then the lowest bit (the slot on the most paths)
+                choices = undecided & ~(z & v & g) or undecided
+                slot = choices & -choices
+                if len(stack) >= self.deepest:
+                    self.deepest = len(stack) + 1
+                    if self.give_up(len(stack) + 1):
+                        return
+                stack.append([z, v, g, slot, [bit for bit in (1, 2, 4) if can[bit] & slot]])
+            # go back to the deepest branch that still has a candidate to try
+            while stack and not stack[-1][4]:
+                stack.pop()
+            if not stack:
+                return
+            while True:
+                z, v, g, slot, left = stack[-1]
+                can[1], can[2], can[4] = z, v, g
+                bit = left.pop(0)
+                for other in (1, 2, 4):
+                    if other != bit:
+                        can[other] &= ~slot
+                self.nodes += 1
+                if self.propagate(can, slot):
+                    break
+                self.backtracks += 1
+                if self.give_up(len(stack)):
+                    return
+                while stack and not stack[-1][4]:
+                    stack.pop()
+                if not stack:
                     return
+
+    def propagate(self, can: list, changed: int, pending: int = 0) -> bool:
+        """
+        Narrow can in place with the same path and total rules as SearchCore.propagate(), until nothing changes.
+        :param changed: the slot bits whose candidates changed, the paths through them are checked first
+        :param pending: the paths (as bits) to check on top of those
+        :return: False means some path, monster total or slot cannot be satisfied any more
+        """
+        masks, needs, nums, slot_paths, every = self.masks, self.needs, self.nums, self.slot_path_bits, self.every
+        while changed:
+            low_bit = changed & -changed
+            pending |= slot_paths[low_bit.bit_length() - 1]
+            changed ^= low_bit
+        while True:
+            while pending:
+                path_bit = pending & -pending
+                pending ^= path_bit
+                i = path_bit.bit_length() - 1
+                direct, twice, mirrored, mirrored_twice = masks[i]
+                z, v, g = can[1], can[2], can[4]
+                # a slot is seen for sure before a mirror when it can't be a ghost, after one when it can't be a
+                # vampire, and it might be seen when it can be anything else
+                sure_direct, maybe_direct = direct & ~g, direct & (z | v)
+                sure_mirrored, maybe_mirrored = mirrored & ~v, mirrored & (z | g)
+                low = (popcount(sure_direct) + popcount(sure_direct & twice) +
+                       popcount(sure_mirrored) + popcount(sure_mirrored & mirrored_twice))
+                high = (popcount(maybe_direct) + popcount(maybe_direct & twice) +
+                        popcount(maybe_mirrored) + popcount(maybe_mirrored & mirrored_twice))
+                need = needs[i]
+                if low > need or high < need:
+                    return False
+                if low == high:
+                    continue
+                mixed_direct, mixed_mirrored = maybe_direct & ~sure_direct, maybe_mirrored & ~sure_mirrored
+                if low == need:
+                    # the path has seen enough, the undecided slots must be hidden
+                    can[1] = z & ~(mixed_direct | mixed_mirrored)
+                    can[2] = v & ~mixed_direct
+                    can[4] = g & ~mixed_mirrored
+                elif high == need:
+                    # the path needs every slot it could still see
+                    can[2] = v & ~mixed_mirrored
+                    can[4] = g & ~mixed_direct
                 else:
-                    raise ex  # something unexpected happened.
-
-def generate_puzzle(height: int, width: int):
-    count = 1
-    while True:
-        print(f"puzzle #{count}")
-        count += 1
-        grid = np.zeros((height, width))
-
-        # at least on quarter of the grid would be mirrors, at most halt the grid
-        num_mirrors = random.randint(height * width // 4, height * width // 2)
-
-        num = 0
-        while num < num_mirrors:
-            x, y = random.randint(0, height - 1), random.randint(0, width - 1)
-            if grid[x, y] == 0:
-                grid[x, y] = random.choice([1, 2])
-                num += 1
-
-        final_grid = grid.astype(str)  # the solution
-        monster_nums = {}  # dict store the num for each monster in the sequence of Z, V, G
-
-        # generate the solution grid using both numbers and visualized version
-        for i, row in enumerate(grid):
-            for j, elem in enumerate(row):
-                if elem == 0:
-                    rand = random.randint(3, 5)  # 3 is Z, 4 is V, 5 is G
-                    if rand == 3:
-                        final_grid[i, j] = "Z"
-                        monster_nums["Z"] = monster_nums.get("Z", 0) + 1
-                    elif rand == 4:
-                        final_grid[i, j] = "V"
-                        monster_nums["V"] = monster_nums.get("V", 0) + 1
-                    elif rand == 5:
-                        final_grid[i, j] = "G"
-                        monster_nums["G"] = monster_nums.get("G", 0) + 1
-                elif elem == 1:
-                    final_grid[i][j] = "/"
-                elif elem == 2:
-                    final_grid[i, j] = "\\"
-        if "Z" not in monster_nums:
-            monster_nums["Z"] = 0
-        if "V" not in monster_nums:
-            monster_nums["V"] = 0
-        if "G" not in monster_nums:
-            monster_nums["G"] = 0
-
-        ms_gen = MirrorMazeSolver(monster_nums, grid, None, final_grid)
-        ms_gen.find_solutions(True)
-        if len(ms_gen.solutions) == 1:
-
-            for value in ms_gen.monster_position_determined.values():
-                # return the monsters in the monster_position_determined to the total numbers
-                ms_gen.monster_nums[value] += 1
-            break
-
-    return {
-        'monster_nums': ms_gen.monster_nums,
-        'border_nums': ms_gen.border_nums,
-        'grid': ms_gen.grid.tolist(),  # Convert np.array to list for JSON serialization
-        'solution': ms_gen.final_grid.tolist()  # Make sure this is in a format that can be JSON serialized
-    }
+                    continue
+                if every & ~(can[1] | can[2] | can[4]):
+                    return False  # some slot has no candidate left
+                changed = mixed_direct | mixed_mirrored
+                while changed:
+                    low_bit = changed & -changed
+                    pending |= slot_paths[low_bit.bit_length() - 1]
+                    changed ^= low_bit
+
+            # the monster totals: fixed slots can only be that monster, possible slots could be
+            z, v, g = can[1], can[2], can[4]
+            for bit, others in ((1, v | g), (2, z | g), (4, z | v)):
+                candidates = can[bit]
+                fixed = popcount(candidates & ~others)
+                possible = popcount(candidates)
+                total = nums[bit]
+                if fixed > total or possible < total:
+                    return False
+                if fixed == total and possible > total:
+                    changed = candidates & others
+                    can[bit] = candidates & ~others  # used up by the fixed slots
+                elif possible == total and fixed < total:
+                    changed = candidates & others
+                    for other in (1, 2, 4):
+                        if other != bit:
+                            can[other] &= ~candidates  # every candidate slot is needed
+                else:
+                    continue
+                while changed:
+                    low_bit = changed & -changed
+                    pending |= slot_paths[low_bit.bit_length() - 1]
+                    changed ^= low_bit
+                # the other counts are stale now, let the next round redo them
+                break
+            if not pending:
+                return True
+
+
+SEARCH_BACKENDS = {"array": SearchCore, "bitset": BitsetCore}
+
+
+class BudgetExhausted(RuntimeError):
+    """
+    Raised by generate_puzzle() when its time or node budget runs out before a unique puzzle turns up.
+    """
+
+    def __init__(self, attempts: int, nodes: int, seconds: float):
+        super().__init__(f"no unique puzzle within the budget ({attempts} attempts, {nodes} nodes, {seconds:.2f} s)")
+        self.attempts, self.nodes, self.seconds = attempts, nodes, seconds
+
+    def __reduce__(self):
+        # so it can be raised in a worker process and caught in the parent
+        return BudgetExhausted, (self.attempts, self.nodes, self.seconds)
+
+    def as_dict(self) -> dict:
+        return {"error": "budget exhausted", "attempts": self.attempts, "nodes": self.nodes, "seconds": self.seconds}
+
+
+def grade_difficulty(metrics: dict) -> str:
+    """
+    Grade a puzzle by the metrics of its uniqueness check:
+    easy means the clues and totals decide every slot without guessing, medium needs a few guesses that go wrong at
+    most MEDIUM_MAX_BACKTRACKS times, anything else is hard.
+    >>> grade_difficulty({"max_depth": 0, "backtracks": 0}), grade_difficulty({"max_depth": 3, "backtracks": 40})
+    ('easy', 'hard')
+    """
+    if metrics["max_depth"] == 0:
+        return "easy"
+    if metrics["backtracks"] <= MEDIUM_MAX_BACKTRACKS:
+        return "medium"
+    return "hard"
+
+
+def generate_puzzle(height: int, width: int, seed=None, on_attempt=None, difficulty: str = None,
+                    stats: SolveStats = None, time_limit: float = None, node_limit: int = None, stop=None):
+    """
+    Draw random grids until one of them has a unique solution.
+    :param seed: int or random.Random to make the puzzle reproducible, None uses the global random module
+    :param on_attempt: optional callback(count, solver), called after every grid has been checked
+    :param difficulty: one of DIFFICULTIES, None takes the first unique puzzle whatever its level
+    :param stats: optional SolveStats that collects the attempts and the time of every phase
+    :param time_limit: seconds the whole generation may take, None means no limit
+    :param node_limit: search nodes the whole generation may use, summed over every attempt, None means no limit
+    :param stop: optional event (anything with is_set()), give up and return None once it is set
+    :return: dict of monster_nums, border_nums, grid, solution, difficulty and the solver metrics
+    :raises BudgetExhausted: when a limit is reached first, the searches are cut off on time so the limits hold
+    >>> generate_puzzle(4, 4, seed=7) == generate_puzzle(4, 4, seed=random.Random(7))
+    True
+    >>> generate_puzzle(9, 9, seed=7, node_limit=10)  # doctest: +ELLIPSIS
+    Traceback (most recent call last):
+    ...
+    mirrorMazeSolver.BudgetExhausted: no unique puzzle within the budget (16 attempts, 11 nodes, ...)
+    """
+    if seed is None:
+        rng = random
+    elif isinstance(seed, random.Random):
+        rng = seed
+    else:
+        rng = random.Random(seed)
+    deadline = None if time_limit is None else perf_counter() + time_limit
+    return _generate_puzzle(height, width, rng, stop, on_attempt, difficulty=difficulty, stats=stats,
+                            deadline=deadline, node_limit=node_limit)
+
+
+def random_candidate(height: int, width: int, rng) -> tuple:
+    """
+    Draw a random grid and a random solution for it.
+    :return: grid (0 empty, 1 "/", 2 "\\"), the solution grid of monsters and mirrors, and monster_nums
+    """
+    grid = [[0] * width for _ in range(height)]
+
+    # at least on quarter of the grid would be mirrors, at most halt the grid
+    num_mirrors = rng.randint(height * width // 4, height * width // 2)
+
+    num = 0
+    while num < num_mirrors:
+        x, y = rng.randint(0, height - 1), rng.randint(0, width - 1)
+        if grid[x][y] == 0:
+            grid[x][y] = rng.choice([1, 2])
+            num += 1
+
+    final_grid = [[str(elem) for elem in row] for row in grid]  # the solution
+    monster_nums = {}  # dict store the num for each monster in the sequence of Z, V, G
+
+    # generate the solution grid using both numbers and visualized version
+    for i, row in enumerate(grid):
+        for j, elem in enumerate(row):
+            if elem == 0:
+                rand = rng.randint(3, 5)  # 3 is Z, 4 is V, 5 is G
+                if rand == 3:
+                    final_grid[i][j] = "Z"
+                    monster_nums["Z"] = monster_nums.get("Z", 0) + 1
+                elif rand == 4:
+                    final_grid[i][j] = "V"
+                    monster_nums["V"] = monster_nums.get("V", 0) + 1
+                elif rand == 5:
+                    final_grid[i][j] = "G"
+                    monster_nums["G"] = monster_nums.get("G", 0) + 1
+            elif elem == 1:
+                final_grid[i][j] = "/"
+            elif elem == 2:
+                final_grid[i][j] = "\\"
+    if "Z" not in monster_nums:
+        monster_nums["Z"] = 0
+    if "V" not in monster_nums:
+        monster_nums["V"] = 0
+    if "G" not in monster_nums:
+        monster_nums["G"] = 0
+    return grid, final_grid, monster_nums
+
+
+def repair_candidate(final_grid: list, monster_nums: dict, ambiguous: list, rng) -> None:
+    """
+    Change the monster in one of the slots that make a candidate ambiguous, in place.
+    :param ambiguous: positions of slots whose monster is not fixed by the border numbers
+    """
+    x, y = rng.choice(ambiguous)
+    old = str(final_grid[x][y])
+    new = rng.choice([monster for monster in ("Z", "V", "G") if monster != old])
+    final_grid[x][y] = new
+    monster_nums[old] -= 1
+    monster_nums[new] += 1
+
+
+def _generate_puzzle(height: int, width: int, rng, stop=None, on_attempt=None, max_repairs: int = MAX_REPAIRS,
+                     difficulty: str = None, stats: SolveStats = None, deadline: float = None, node_limit: int = None):
+    """
+    Draw random grids from rng until one of them has a unique solution. A candidate that turns out ambiguous is not
+    thrown away right away: the monster in one of the slots the two solutions disagree on is changed and the
+    candidate is checked again, up to max_repairs times. Candidates with two slots that can obviously trade their
+    monsters (see find_swappable_cells()) are repaired the same way without running the solver.
+    :param rng: random.Random, or the random module itself
+    :param stop: optional event, give up (and return None) once it is set
+    :param on_attempt: see generate_puzzle()
+    :param max_repairs: how many times one candidate may be changed before a new one is drawn
+    :param difficulty: see generate_puzzle(), candidates of any other level are dropped
+    :param stats: see generate_puzzle()
+    :param deadline: perf_counter() time to raise BudgetExhausted at, None means no limit
+    :param node_limit: see generate_puzzle()
+    """
+    if difficulty is not None and difficulty not in DIFFICULTIES:
+        raise ValueError(f"difficulty should be one of {DIFFICULTIES}, not {difficulty!r}")
+    limits = DIFFICULTY_LIMITS[difficulty] if difficulty else {}
+    if stats is None:
+        stats = NO_STATS
+    start = perf_counter()
+    count = nodes = 0
+
+    def check_budget() -> None:
+        if (deadline is not None and perf_counter() > deadline or
+                node_limit is not None and nodes >= node_limit):
+            raise BudgetExhausted(count, nodes, perf_counter() - start)
+
+    while stop is None or not stop.is_set():
+        check_budget()
+        with stats.phase("candidate"):
+            grid, final_grid, monster_nums = random_candidate(height, width, rng)
+        stats.count("candidates")
+        for _ in range(max_repairs + 1):
+            check_budget()
+            count += 1
+            stats.count("attempts")
+            logger.debug("puzzle #%d", count)
+            ms_gen = MirrorMazeSolver(dict(monster_nums), grid, None, final_grid, stats)
+            with stats.phase("precheck"):
+                ambiguous = ms_gen.find_swappable_cells()
+            if ambiguous is not None:
+                stats.count("prechecked")
+            unique = False
+            if ambiguous is None:
+                # a second solution is enough to reject the grid, no need to search any further. Every puzzle is
+                # graded by the metrics of this search, so it has to run even for a layout seen before
+                unique = ms_gen.is_unique(True, propagate=True, backend=GENERATION_BACKEND, deadline=deadline,
+                                          node_limit=None if node_limit is None else node_limit - nodes,
+                                          cache=False, stop=stop, **limits)
+                nodes += ms_gen.metrics["nodes"]
+                if len(ms_gen.solutions) == 2:
+                    first, second = ms_gen.solutions
+                    ambiguous = [pos for pos, monster in first.items() if second[pos] != monster]
+            if on_attempt is not None:
+                on_attempt(count, ms_gen)
+            if unique and difficulty is not None and grade_difficulty(ms_gen.metrics) != difficulty:
+                break  # the wrong level, changing a monster is as likely to make it worse as better
+            if ambiguous is None and not unique:
+                break  # cut off by the difficulty limits, the candidate is harder than asked for
+            if unique:
+
+                for value in ms_gen.monster_position_determined.values():
+                    # return the monsters in the monster_position_determined to the total numbers
+                    ms_gen.monster_nums[value] += 1
+
+                return {
+                    'monster_nums': ms_gen.monster_nums,
+                    'border_nums': ms_gen.border_nums,
+                    'grid': [list(row) for row in ms_gen.grid],  # copies, the candidate lists are reused
+                    'solution': [list(row) for row in ms_gen.final_grid],
+                    'difficulty': grade_difficulty(ms_gen.metrics),
+                    'metrics': ms_gen.metrics
+                }
+            if stop is not None and stop.is_set():
+                break
+            with stats.phase("candidate"):
+                repair_candidate(final_grid, monster_nums, list(ambiguous), rng)
+            stats.count("repairs")
+    return None
+
+
+class _StopFlag:
+    """
+    Stop event of the worker processes, a byte of shared memory. The search checks it at every dead end, and unlike
+    multiprocessing.Event it can be read without taking a lock.
+    """
+
+    __slots__ = ("value",)
+
+    def __init__(self):
+        import multiprocessing
+        self.value = multiprocessing.RawValue("b", 0)
+
+    def set(self) -> None:
+        self.value.value = 1
+
+    def is_set(self) -> bool:
+        return self.value.value != 0
+
+
+_stop_event = None  # set in every worker process of generate_puzzle_parallel(), tells the worker to give up
+
+
+def _init_worker(stop_event) -> None:
+    global _stop_event
+    _stop_event = stop_event
+
+
+def _generate_in_worker(height: int, width: int, seed: int, difficulty: str = None):
+    return _generate_puzzle(height, width, random.Random(seed), _stop_event, difficulty=difficulty)
+
+
+def generate_puzzle_parallel(height: int, width: int, workers: int = None, seed: int = None,
+                             difficulty: str = None) -> dict:
+    """
+    Search for a puzzle in several processes at once, each drawing grids from its own seeded RNG. The first unique
+    puzzle wins and the other workers stop at their next attempt.
+    :param workers: num of processes, default one per core
+    :param seed: seeds the workers' RNGs
+    :param difficulty: see generate_puzzle()
+    :return: the puzzle in the same format as generate_puzzle()
+    """
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    workers = workers or os.cpu_count() or 1
+    seeds = random.Random(seed)
+    stop = _StopFlag()
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(stop,)) as executor:
+        futures = [executor.submit(_generate_in_worker, height, width, seeds.getrandbits(64), difficulty)
+                   for _ in range(workers)]
+        try:
+            for future in as_completed(futures):
+                puzzle = future.result()
+                if puzzle is not None:
+                    return puzzle
+        finally:
+            # also when a worker raised, the shutdown waits for the others otherwise
+            stop.set()
+
+
+def generate_puzzles(n: int, height: int, width: int, workers: int = None, seed: int = None,
+                     difficulty: str = None) -> list:
+    """
+    Generate n puzzles of the same size, spread over several processes.
+    :param workers: num of processes, default one per core
+    :param seed: seeds the RNG of every puzzle
+    :param difficulty: see generate_puzzle()
+    :return: list of n puzzles in the same format as generate_puzzle()
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    workers = workers or os.cpu_count() or 1
+    seeds = random.Random(seed)
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(None,)) as executor:
+        return list(executor.map(_generate_in_worker, repeat(height, n), repeat(width, n),
+                                 [seeds.getrandbits(64) for _ in range(n)], repeat(difficulty, n)))
 
 
 if __name__ == '__main__':
+    logging.basicConfig(level=logging.DEBUG, format="%(message)s")
     generate_puzzle(5, 5)
\ No newline at end of file
@@ -0,0 +1,326 @@
+"""
+The puzzle endpoint as an ASGI app, for running it as a long-lived server (local development, a container) where one
+slow generation must not hold up every other request:
+
+    uvicorn puzzleAsgi:app
+
+Requests are parsed and answered like api/generate_puzzle.py does (see puzzleService), but puzzles are generated in
+a pool of PUZZLE_WORKERS processes (default one per core), so requests are served concurrently and the throughput
+grows with the workers. At most PUZZLE_MAX_PENDING generations (default 4 per worker) are queued or running, the
+requests beyond that get 503 right away. Requests for the same ?id= share one generation while it runs, and a
+generation that no client waits for any more is cancelled: dropped from the queue, or stopped at its next attempt.
+"""
+
+import asyncio
+import multiprocessing
+import os
+import random
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from mirrorMazeSolver import BudgetExhausted, SolveStats, generate_puzzle
+from puzzlePool import get_pool
+from puzzleService import (FORMATS, NODE_BUDGET, STREAM_BUDGET, Response, allowed_origin, body_response,
+                           budget_fallback, cached_response, encode_chunk, encode_puzzle, error_chunk, id_body,
+                           json_response, maybe_refill, parse_request, stream_response, time_budget)
+
+WORKERS = int(os.environ.get('PUZZLE_WORKERS') or os.cpu_count() or 1)
+MAX_PENDING = int(os.environ.get('PUZZLE_MAX_PENDING') or 4 * WORKERS)
+# how many ?id= puzzles are kept, like puzzleService.generate_by_id()
+ID_CACHE_SIZE = 256
+
+
+class ServerBusy(RuntimeError):
+    """
+    Raised instead of queueing a generation when MAX_PENDING of them are pending already.
+    """
+
+    def as_dict(self) -> dict:
+        return {"error": "busy"}
+
+
+class ClientGone(Exception):
+    """
+    The client disconnected before its response was ready, or the generation it waited for was cancelled.
+    """
+
+
+_cancel_flags = None  # in a worker process: one flag per slot of Generator, set when that slot's generation is dropped
+
+
+def _init_worker(flags) -> None:
+    global _cancel_flags
+    _cancel_flags = flags
+
+
+class _CancelFlag:
+    """
+    The stop event of generate_puzzle() for the generation in one slot.
+    """
+
+    __slots__ = ("slot",)
+
+    def __init__(self, slot: int):
+        self.slot = slot
+
+    def is_set(self) -> bool:
+        return _cancel_flags[self.slot] != 0
+
+
+def _generate_in_worker(slot: int, height: int, width: int, seed: int, difficulty: str, deadline: float) -> tuple:
+    """
+    :param deadline: time.time() to give up at, it is set when the request comes in so the time spent in the queue
+        counts against the budget too
+    :return: the puzzle (None when it was cancelled) and the SolveStats of generating it
+    """
+    stats = SolveStats()
+    puzzle = generate_puzzle(height, width, seed=seed, difficulty=difficulty, stats=stats,
+                             time_limit=deadline - time.time(), node_limit=NODE_BUDGET, stop=_CancelFlag(slot))
+    return puzzle, stats
+
+
+class Generator:
+    """
+    The worker processes and the generations pending on them. Every pending generation holds one of MAX_PENDING
+    slots, whose flag in shared memory tells the worker to stop. Only used from the event loop's thread.
+    """
+
+    def __init__(self, workers: int = WORKERS, max_pending: int = MAX_PENDING):
+        self.flags = multiprocessing.RawArray('b', max_pending)
+        self.free = list(range(max_pending))  # the slots not in use
+        self.executor = ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(self.flags,))
+        self.in_flight = {}  # key of an ?id= -> [the task generating it, num of requests waiting for it]
+        self.by_id = OrderedDict()  # key of an ?id= -> its puzzle, the most recent ID_CACHE_SIZE
+
+    async def run(self, height: int, width: int, seed: int, difficulty: str, deadline: float) -> tuple:
+        """
+        Generate in a worker process, cancelling the task cancels the generation.
+        :return: see _generate_in_worker(), the puzzle is None when the generation was cancelled
+        :raises ServerBusy: when there is no free slot
+        :raises BudgetExhausted: when the worker ran out of budget
+        """
+        if not self.free:
+            raise ServerBusy()
+        slot = self.free.pop()
+        self.flags[slot] = 0
+        loop = asyncio.get_running_loop()
+        future = self.executor.submit(_generate_in_worker, slot, height, width, seed, difficulty, deadline)
+        # the slot is only free again once the worker is done with it, not when the request stops waiting
+        future.add_done_callback(lambda _: loop.call_soon_threadsafe(self.free.append, slot))
+        try:
+            return await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            # a queued one is dropped by the cancel itself, a running one stops at this. A finished one may have
+            # given its slot to another generation already, which must not be stopped
+            if not future.done():
+                self.flags[slot] = 1
+            raise
+
+    async def generate(self, pool, height: int, width: int, difficulty: str = None, stats: SolveStats = None,
+                       deadline: float = None) -> dict:
+        """
+        A random puzzle, see puzzleService.generate().
+        :param deadline: see _generate_in_worker(), default time_budget() from now
+        """
+        if deadline is None:
+            deadline = time.time() + time_budget(height, width)
+        try:
+            if deadline <= time.time():
+                # no time left, or a size that is only served from the pool: don't take a slot just to fail
+                raise BudgetExhausted(0, 0, 0.0)
+            # the workers are forked with the same random state, so every puzzle gets its own seed from here
+            puzzle, worker_stats = await self.run(height, width, random.getrandbits(64), difficulty, deadline)
+        except BudgetExhausted as exc:
+            return await asyncio.to_thread(budget_fallback, pool, height, width, difficulty, exc)
+        if puzzle is None:
+            raise ClientGone()
+        if stats is not None:
+            stats.update(worker_stats)
+        return puzzle
+
+    async def by_seed(self, height: int, width: int, seed: int, difficulty: str = None,
+                      deadline: float = None) -> dict:
+        """
+        The puzzle of an ?id=. Requests for the same one wait for the same generation, which is cancelled when the
+        last of them is cancelled.
+        :param deadline: see generate(), the first request's deadline holds for the shared generation
+        """
+        if deadline is None:
+            deadline = time.time() + time_budget(height, width)
+        key = height, width, seed, difficulty
+        if key in self.by_id:
+            return self.by_id[key]
+        entry = self.in_flight.get(key)
+        if entry is None:
+            task = asyncio.ensure_future(self.run(height, width, seed, difficulty, deadline))
+            entry = self.in_flight[key] = [task, 0]
+            entry[0].add_done_callback(lambda _: self.drop(key, entry))
+        entry[1] += 1
+        try:
+            puzzle, _ = await asyncio.shield(entry[0])
+        except asyncio.CancelledError:
+            entry[1] -= 1
+            if not entry[1]:
+                # the next request for it starts over, instead of joining the generation being cancelled
+                self.drop(key, entry)
+                entry[0].cancel()
+            raise
+        if puzzle is None:
+            raise ClientGone()
+        self.by_id[key] = puzzle
+        if len(self.by_id) > ID_CACHE_SIZE:
+            self.by_id.popitem(last=False)
+        return puzzle
+
+    def drop(self, key: tuple, entry: list) -> None:
+        if self.in_flight.get(key) is entry:
+            del self.in_flight[key]
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+_generator = None
+
+
+def get_generator() -> Generator:
+    global _generator
+    if _generator is None:
+        _generator = Generator()
+    return _generator
+
+
+async def _until_disconnect(receive) -> None:
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def _unless_gone(awaitable, disconnect: asyncio.Future):
+    """
+    :return: the result of awaitable
+    :raises ClientGone: when the client disconnects first, awaitable is cancelled then
+    """
+    task = asyncio.ensure_future(awaitable)
+    await asyncio.wait({task, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+    if task.done():
+        return task.result()
+    task.cancel()
+    raise ClientGone()
+
+
+async def respond(query: str, headers: dict, disconnect: asyncio.Future) -> Response:
+    """
+    Answer one GET like puzzleService.respond(), with the generation on the worker processes.
+    :param headers: the request headers by their lowercase names
+    :param disconnect: done when the client disconnects
+    """
+    start = time.time()  # the budget of one puzzle counts from here, queueing included
+    cors_origin = allowed_origin(headers.get('origin'))
+    try:
+        params = parse_request(query, headers.get('accept'))
+    except ValueError as exc:
+        return json_response(400, {'error': str(exc)}, cors_origin)
+    height, width, difficulty, fmt = params['height'], params['width'], params['difficulty'], params['format']
+    deadline = start + time_budget(height, width)
+    generator = get_generator()
+    try:
+        if params['id'] is not None:
+            puzzle_data = await _unless_gone(generator.by_seed(height, width, params['id'], difficulty, deadline),
+                                             disconnect)
+            body, etag = id_body(puzzle_data, fmt)
+            return cached_response(body, etag, FORMATS[fmt], cors_origin, headers.get('if-none-match'))
+
+        pool = get_pool()
+        maybe_refill(pool)
+        if params['count'] is not None:
+            return stream_response(stream_puzzles(generator, pool, height, width, difficulty, params['count'], fmt,
+                                                  disconnect, start + STREAM_BUDGET), fmt, cors_origin)
+        stats = SolveStats()
+        with stats.phase('pool'):
+            puzzle_data = await asyncio.to_thread(pool.pop, height, width, difficulty)
+        if puzzle_data is None:
+            with stats.phase('generate'):
+                puzzle_data = await _unless_gone(generator.generate(pool, height, width, difficulty, stats, deadline),
+                                                 disconnect)
+        with stats.phase('encode'):
+            body = encode_puzzle(puzzle_data, fmt)
+        return body_response(200, body, FORMATS[fmt], cors_origin, stats.server_timing())
+    except BudgetExhausted as exc:
+        return json_response(503, exc.as_dict(), cors_origin)
+    except ServerBusy as exc:
+        response = json_response(503, exc.as_dict(), cors_origin)
+        response.headers.append(('Retry-After', '1'))
+        return response
+
+
+async def stream_puzzles(generator: Generator, pool, height: int, width: int, difficulty: str, count: int,
+                         fmt: str, disconnect: asyncio.Future, deadline: float = None):
+    """
+    See puzzleService.stream_puzzles(), a busy server ends the stream like a budget that ran out.
+    :param deadline: time.time() after which no more puzzles are generated, default STREAM_BUDGET from now
+    """
+    if deadline is None:
+        deadline = time.time() + STREAM_BUDGET
+    for _ in range(count):
+        puzzle_data = await asyncio.to_thread(pool.pop, height, width, difficulty)
+        try:
+            if puzzle_data is None:
+                # each puzzle within its own budget and what is left of the stream's
+                puzzle_deadline = min(deadline, time.time() + time_budget(height, width))
+                puzzle_data = await _unless_gone(generator.generate(pool, height, width, difficulty,
+                                                                    deadline=puzzle_deadline), disconnect)
+        except (BudgetExhausted, ServerBusy) as exc:
+            chunk = error_chunk(exc, fmt)
+            if chunk is not None:
+                yield chunk
+            return
+        yield encode_chunk(puzzle_data, fmt)
+
+
+async def _send(send, response: Response) -> None:
+    await send({'type': 'http.response.start', 'status': response.status,
+                'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                            for name, value in response.headers]})
+    if response.chunks is None:
+        await send({'type': 'http.response.body', 'body': response.body})
+        return
+    async for chunk in response.chunks:
+        await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+async def _lifespan(receive, send) -> None:
+    global _generator
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            get_generator()  # start the workers before the first request comes in
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            if _generator is not None:
+                _generator.close()
+                _generator = None
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send) -> None:
+    if scope['type'] == 'lifespan':
+        await _lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+    if scope['method'] != 'GET':
+        response = json_response(405, {'error': "only GET is supported"})
+        response.headers.append(('Allow', 'GET'))
+        await _send(send, response)
+        return
+    headers = {name.decode('latin-1').lower(): value.decode('latin-1') for name, value in scope['headers']}
+    disconnect = asyncio.ensure_future(_until_disconnect(receive))
+    try:
+        await _send(send, await respond(scope['query_string'].decode('latin-1'), headers, disconnect))
+    except ClientGone:
+        pass  # nobody to answer, and the generation has been cancelled
+    finally:
+        disconnect.cancel()
@@ -0,0 +1,224 @@
+"""
+Benchmark for the puzzle generator on fixed seed corpora, so two versions can be compared run by run.
+
+    python puzzleBenchmark.py --sizes 3x3 4x4 5x5 --seeds 20 --out bench.json
+    python puzzleBenchmark.py --baseline old.json
+    python puzzleBenchmark.py --sizes 6x6 --difficulty easy
+
+For every size it generates one puzzle per seed and reports the attempts per unique puzzle, the search nodes, the
+time spent tracing paths (path_finder), searching and checking (propagation, or the generator's clue counting), and
+the p50/p95/p99 wall time per puzzle, as JSON.
+
+    python puzzleBenchmark.py --import-check
+
+imports the API handler in fresh interpreters with -X importtime instead, and fails when it loads one of
+LAZY_MODULES or takes longer than --import-budget-ms, so cold starts don't regress unnoticed.
+"""
+
+import argparse
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import mirrorMazeSolver
+from mirrorMazeSolver import DIFFICULTIES, GENERATION_BACKEND, SEARCH_BACKENDS, MirrorMazeSolver, generate_puzzle
+from puzzlePool import parse_size
+
+DEFAULT_SIZES = [(n, n) for n in range(3, 9)]
+HANDLER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "api", "generate_puzzle.py")
+# heavy modules the handler must not import when it starts, only the batch and parallel features load them
+LAZY_MODULES = ("numpy", "multiprocessing", "concurrent.futures")
+IMPORT_BUDGET_MS = 150  # generous, the modules above are the sharper check
+
+
+def percentile(values: list, p: float) -> float:
+    """
+    Nearest-rank percentile.
+    >>> percentile([4, 1, 3, 2], 50), percentile([4, 1, 3, 2], 99)
+    (2, 4)
+    """
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+class PhaseTimer:
+    """
+    Wrap a method of a class so the time spent in it is added up, for as long as the timer is installed.
+    """
+
+    def __init__(self, owner, name: str):
+        self.owner, self.name = owner, name
+        self.original = getattr(owner, name)
+        self.seconds = 0.0
+
+    def __enter__(self):
+        original = self.original
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                self.seconds += time.perf_counter() - start
+
+        setattr(self.owner, self.name, timed)
+        return self
+
+    def __exit__(self, *exc) -> None:
+        setattr(self.owner, self.name, self.original)
+
+
+def run_size(height: int, width: int, seeds: list, difficulty: str = None) -> dict:
+    """
+    Generate one puzzle for each seed and collect the stats of the whole corpus.
+    """
+    attempts, nodes, walls = [], [], []
+    # every grid is new, so clear the tracing cache to time the tracing itself
+    mirrorMazeSolver._trace_paths.cache_clear()
+    with PhaseTimer(MirrorMazeSolver, "path_finder") as tracing, \
+            PhaseTimer(MirrorMazeSolver, "find_solutions") as search, \
+            PhaseTimer(MirrorMazeSolver, "generate_border_nums") as clues, \
+            PhaseTimer(SEARCH_BACKENDS[GENERATION_BACKEND], "propagate") as propagation:
+        for seed in seeds:
+            counts = [0, 0]
+
+            def on_attempt(count: int, solver: MirrorMazeSolver) -> None:
+                counts[0] = count
+                counts[1] += solver.metrics.get("nodes", 0)
+
+            start = time.perf_counter()
+            generate_puzzle(height, width, seed=seed, on_attempt=on_attempt, difficulty=difficulty)
+            walls.append(time.perf_counter() - start)
+            attempts.append(counts[0])
+            nodes.append(counts[1])
+    total = sum(walls)
+    return {
+        "puzzles": len(seeds),
+        "attempts": sum(attempts),
+        "attempts_per_puzzle": sum(attempts) / len(seeds),
+        "nodes": sum(nodes),
+        "nodes_per_puzzle": sum(nodes) / len(seeds),
+        "seconds": {
+            "total": total,
+            "path_finder": tracing.seconds,
+            "search": search.seconds - propagation.seconds,
+            "checks": propagation.seconds + clues.seconds,
+            "other": total - tracing.seconds - search.seconds - clues.seconds,
+        },
+        "wall_ms": {f"p{p}": 1000 * percentile(walls, p) for p in (50, 95, 99)},
+    }
+
+
+def run(sizes: list, seeds: list, progress=None, difficulty: str = None) -> dict:
+    results = {}
+    for height, width in sizes:
+        results[f"{height}x{width}"] = run_size(height, width, seeds, difficulty)
+        if progress is not None:
+            progress(f"{height}x{width}", results[f"{height}x{width}"])
+    return {
+        "python": platform.python_version(),
+        "seeds": [seeds[0], seeds[-1]] if seeds else [],
+        "difficulty": difficulty,
+        "sizes": results,
+    }
+
+
+def import_time(path: str = HANDLER, runs: int = 5) -> dict:
+    """
+    Import a module file in fresh interpreters with -X importtime.
+    :return: the fastest cumulative import time in ms over the runs, and every module it imported
+    """
+    directory, name = os.path.split(os.path.abspath(path))
+    code = (f"import sys; sys.path[:0] = [{directory!r}, {os.path.dirname(directory)!r}]; "
+            f"import {os.path.splitext(name)[0]}")
+    best, modules = None, set()
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True,
+                                check=True)
+        for line in result.stderr.splitlines():
+            fields = line.split("|")
+            if len(fields) != 3 or not fields[1].strip().isdigit():
+                continue  # the header, or output that isn't from -X importtime
+            module = fields[2].strip()
+            modules.add(module)
+            if module == os.path.splitext(name)[0]:
+                ms = int(fields[1]) / 1000
+                best = ms if best is None else min(best, ms)
+    return {"ms": best, "modules": sorted(modules)}
+
+
+def check_import(stats: dict, budget_ms: float = IMPORT_BUDGET_MS) -> list:
+    """
+    :param stats: from import_time()
+    :return: what is wrong with the import, empty when it is fine
+    >>> check_import({"ms": 250.0, "modules": ["json", "numpy", "numpy.linalg"]})
+    ['imports numpy', 'took 250.0 ms, the budget is 150 ms']
+    """
+    problems = [f"imports {lazy}" for lazy in LAZY_MODULES if lazy in stats["modules"]]
+    if stats["ms"] > budget_ms:
+        problems.append(f"took {stats['ms']:.1f} ms, the budget is {budget_ms:g} ms")
+    return problems
+
+
+def compare(report: dict, baseline: dict) -> list:
+    """
+    :return: one line per size shared by both reports, with the ratio new / baseline of the key numbers
+    """
+    lines = []
+    for size, new in report["sizes"].items():
+        old = baseline["sizes"].get(size)
+        if old is None:
+            continue
+        ratios = []
+        for label, key in (("p50", ("wall_ms", "p50")), ("p99", ("wall_ms", "p99")), ("nodes", ("nodes",)),
+                           ("attempts", ("attempts",))):
+            a, b = new, old
+            for k in key:
+                a, b = a[k], b[k]
+            ratios.append(f"{label} x{a / b:.2f}" if b else f"{label} {a}")
+        lines.append(f"{size}: " + ", ".join(ratios))
+    return lines
+
+
+def main(argv: list = None) -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the puzzle generator on fixed seeds.")
+    parser.add_argument("--sizes", nargs="*", type=parse_size, default=DEFAULT_SIZES, help="sizes like 5x5")
+    parser.add_argument("--seeds", type=int, default=20, help="num of seeds (puzzles) per size")
+    parser.add_argument("--first-seed", type=int, default=0)
+    parser.add_argument("--out", help="write the JSON report here instead of stdout")
+    parser.add_argument("--baseline", help="JSON report of an earlier run to compare against")
+    parser.add_argument("--difficulty", choices=DIFFICULTIES, help="only accept puzzles of this difficulty")
+    parser.add_argument("--import-check", action="store_true", help="check the cold import of the API handler")
+    parser.add_argument("--import-budget-ms", type=float, default=IMPORT_BUDGET_MS)
+    args = parser.parse_args(argv)
+
+    if args.import_check:
+        stats = import_time()
+        problems = check_import(stats, args.import_budget_ms)
+        print(f"{os.path.relpath(HANDLER)}: {stats['ms']:.1f} ms, {len(stats['modules'])} modules", file=sys.stderr)
+        for problem in problems:
+            print(f"cold import regressed: {problem}", file=sys.stderr)
+        sys.exit(1 if problems else 0)
+
+    seeds = list(range(args.first_seed, args.first_seed + args.seeds))
+    report = run(args.sizes, seeds, progress=lambda size, stats: print(
+        f"{size}: p50 {stats['wall_ms']['p50']:.1f} ms, {stats['attempts_per_puzzle']:.1f} attempts/puzzle",
+        file=sys.stderr), difficulty=args.difficulty)
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as file:
+            file.write(text + "\n")
+    else:
+        print(text)
+    if args.baseline:
+        with open(args.baseline) as file:
+            for line in compare(report, json.load(file)):
+                print(line, file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
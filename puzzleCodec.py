@@ -0,0 +1,138 @@
+"""
+Compact wire format for puzzles, the "packed" format of the API.
+
+One puzzle is one frame of bytes:
+    version, height, width (1 byte each), the Z, V and G totals (2 bytes each, big-endian), the difficulty (1 byte,
+    0 for none, else its index in DIFFICULTIES plus one), the border numbers in the order of top, left, bottom, right
+    (1 byte each), the grid (2 bits a cell: 0 empty, 1 "/", 2 "\\"), then the monster of every empty cell of the
+    solution (2 bits each: 1 "Z", 2 "V", 3 "G").
+The 2-bit fields are packed four to a byte, the first one in the highest bits, and each field starts on a new byte.
+A frame knows its own length, so frames can be sent back to back. Clients that can't take raw bytes get the frame in
+base64. The solver metrics are not part of the packed format.
+"""
+
+import base64
+import struct
+
+from mirrorMazeSolver import DIFFICULTIES
+
+VERSION = 1
+_HEADER = struct.Struct(">BBBHHHB")
+_MIRRORS = {0: None, 1: "/", 2: "\\"}
+_MONSTER_CODES = {"Z": 1, "V": 2, "G": 3}
+_CODE_MONSTERS = {code: monster for monster, code in _MONSTER_CODES.items()}
+
+
+def _pack_2bit(values: list) -> bytes:
+    """
+    >>> _pack_2bit([1, 2, 3, 0, 2]).hex()
+    '6c80'
+    """
+    packed = bytearray((len(values) + 3) // 4)
+    for k, value in enumerate(values):
+        packed[k >> 2] |= value << (6 - 2 * (k & 3))
+    return bytes(packed)
+
+
+def _unpack_2bit(data: bytes, offset: int, num: int) -> list:
+    return [data[offset + (k >> 2)] >> (6 - 2 * (k & 3)) & 3 for k in range(num)]
+
+
+def pack_puzzle(puzzle: dict) -> bytes:
+    """
+    :param puzzle: in the format of mirrorMazeSolver.generate_puzzle()
+    :return: the puzzle as one frame
+    """
+    height, width = len(puzzle["grid"]), len(puzzle["grid"][0])
+    nums = puzzle["monster_nums"]
+    difficulty = puzzle.get("difficulty")
+    header = _HEADER.pack(VERSION, height, width, nums["Z"], nums["V"], nums["G"],
+                          0 if difficulty is None else DIFFICULTIES.index(difficulty) + 1)
+    border = bytes(num for side in ("top", "left", "bottom", "right") for num in puzzle["border_nums"][side])
+    cells = [int(elem) for row in puzzle["grid"] for elem in row]
+    monsters = [_MONSTER_CODES[monster] for row, cell_row in zip(puzzle["solution"], puzzle["grid"])
+                for monster, elem in zip(row, cell_row) if elem == 0]
+    return header + border + _pack_2bit(cells) + _pack_2bit(monsters)
+
+
+def _unpack_frame(data: bytes, offset: int) -> tuple:
+    """
+    :return: the puzzle that starts at offset, and the offset right after it
+    """
+    if offset + _HEADER.size > len(data):
+        raise ValueError("packed puzzle is cut short")
+    version, height, width, zombies, vampires, ghosts, difficulty = _HEADER.unpack_from(data, offset)
+    if version != VERSION:
+        raise ValueError(f"unknown packed puzzle version {version}")
+    if difficulty > len(DIFFICULTIES):
+        raise ValueError("invalid packed puzzle")
+    offset += _HEADER.size
+    # the header gives the length up to the monsters, the cells give the num of monsters
+    if offset + 2 * (height + width) + (height * width + 3) // 4 > len(data):
+        raise ValueError("packed puzzle is cut short")
+    border = list(data[offset:offset + 2 * (height + width)])
+    offset += 2 * (height + width)
+    cells = _unpack_2bit(data, offset, height * width)
+    offset += (height * width + 3) // 4
+    num_empty = cells.count(0)
+    if offset + (num_empty + 3) // 4 > len(data):
+        raise ValueError("packed puzzle is cut short")
+    monsters = _unpack_2bit(data, offset, num_empty)
+    # 3 is no cell and 0 is no monster
+    if 3 in cells or 0 in monsters:
+        raise ValueError("invalid packed puzzle")
+    monsters = iter(monsters)
+    offset += (num_empty + 3) // 4
+
+    grid = [cells[x * width:(x + 1) * width] for x in range(height)]
+    solution = [[_MIRRORS[elem] or _CODE_MONSTERS[next(monsters)] for elem in row] for row in grid]
+    puzzle = {
+        "monster_nums": {"Z": zombies, "V": vampires, "G": ghosts},
+        "border_nums": {
+            "top": border[:width],
+            "left": border[width:width + height],
+            "bottom": border[width + height:2 * width + height],
+            "right": border[2 * width + height:],
+        },
+        "grid": grid,
+        "solution": solution,
+    }
+    if difficulty:
+        puzzle["difficulty"] = DIFFICULTIES[difficulty - 1]
+    return puzzle, offset
+
+
+def unpack_puzzle(data) -> dict:
+    """
+    :param data: one frame, as bytes or as base64 text
+    :return: the puzzle in the format of mirrorMazeSolver.generate_puzzle(), without the metrics
+    >>> puzzle = {"monster_nums": {"Z": 1, "V": 1, "G": 1}, "grid": [[0, 2], [0, 0]],
+    ...           "border_nums": {"top": [1, 0], "left": [1, 2], "bottom": [1, 2], "right": [0, 2]},
+    ...           "solution": [["G", "\\\\"], ["V", "Z"]], "difficulty": "easy"}
+    >>> packed = pack_puzzle(puzzle)
+    >>> len(packed), unpack_puzzle(packed) == puzzle
+    (20, True)
+    >>> unpack_puzzle(base64.b64encode(packed).decode()) == puzzle
+    True
+    >>> unpack_puzzle(packed[:19])
+    Traceback (most recent call last):
+    ValueError: packed puzzle is cut short
+    >>> unpack_puzzle(packed[:-2] + bytes([packed[-2] | 3, 0]))
+    Traceback (most recent call last):
+    ValueError: invalid packed puzzle
+    """
+    if isinstance(data, str):
+        data = base64.b64decode(data)
+    return _unpack_frame(data, 0)[0]
+
+
+def unpack_puzzles(data: bytes) -> list:
+    """
+    :param data: frames sent back to back, like the body of ?count=N&format=packed
+    :return: the puzzles, see unpack_puzzle()
+    """
+    puzzles, offset = [], 0
+    while offset < len(data):
+        puzzle, offset = _unpack_frame(data, offset)
+        puzzles.append(puzzle)
+    return puzzles
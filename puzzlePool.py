@@ -0,0 +1,252 @@
+"""
+Pool of pre-generated puzzles, so the API can answer without running the generator.
+
+The puzzles are kept in a SQLite file keyed by (height, width) and tagged with their difficulty. A puzzle that is a
+rotation or reflection of one already in the pool is not added again (see puzzleSymmetry). Fill it before deploying with
+    python puzzlePool.py fill --sizes 5x5 6x6 --target 200
+and ship the file with the deployment. It is in .gitignore, so the file a local server creates is not committed by
+accident: add a filled one with git add -f. When the file sits on a read-only filesystem (like a serverless bundle),
+it is copied to the temp directory the first time it is opened, so puzzles can still be popped from the copy.
+"""
+
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+
+from mirrorMazeSolver import generate_puzzle, generate_puzzles
+from puzzleSymmetry import canonical_key
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "puzzle_pool.sqlite3")
+# how many puzzles to keep ready for each (height, width)
+DEFAULT_TARGETS = {(4, 4): 50, (5, 5): 200, (6, 6): 200, (7, 7): 100}
+
+
+def parse_size(text: str) -> tuple:
+    """
+    >>> parse_size("5x6")
+    (5, 6)
+    """
+    height, width = text.lower().split("x")
+    return int(height), int(width)
+
+
+def parse_targets(text: str) -> dict:
+    """
+    Read per-size targets from a string like "5x5=200,6x6=100".
+    >>> parse_targets("5x5=200, 6x6=100")
+    {(5, 5): 200, (6, 6): 100}
+    """
+    targets = {}
+    for item in text.split(","):
+        if item.strip():
+            size, num = item.split("=")
+            targets[parse_size(size.strip())] = int(num)
+    return targets
+
+
+class PuzzlePool:
+
+    def __init__(self, path: str = DEFAULT_PATH, targets: dict = None):
+        self.path = path
+        self.targets = dict(DEFAULT_TARGETS if targets is None else targets)  # (height, width) -> num to keep ready
+        self.lock = threading.Lock()  # one connection is shared by the request and the refill threads
+        self.refill_thread = None
+        self.conn = sqlite3.connect(self.writable_path(path), check_same_thread=False, isolation_level=None)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS puzzles ("
+                          "id INTEGER PRIMARY KEY, height INTEGER NOT NULL, width INTEGER NOT NULL, data TEXT NOT NULL)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS puzzles_size ON puzzles (height, width, id)")
+        if "difficulty" not in [column[1] for column in self.conn.execute("PRAGMA table_info(puzzles)")]:
+            # pools filled before puzzles were graded, their puzzles are only served when no difficulty is asked for
+            self.conn.execute("ALTER TABLE puzzles ADD COLUMN difficulty TEXT")
+        if "canonical" not in [column[1] for column in self.conn.execute("PRAGMA table_info(puzzles)")]:
+            # older rows have no key (NULLs don't collide), only the puzzles added from now on are deduplicated
+            self.conn.execute("ALTER TABLE puzzles ADD COLUMN canonical TEXT")
+        self.conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS puzzles_canonical ON puzzles (canonical)")
+
+    @staticmethod
+    def writable_path(path: str) -> str:
+        """
+        :return: path itself, or a copy of it in the temp directory when it can't be written to
+        """
+        if path == ":memory:" or os.access(os.path.dirname(path) or ".", os.W_OK):
+            return path
+        copy = os.path.join(tempfile.gettempdir(), os.path.basename(path))
+        if not os.path.exists(copy) and os.path.exists(path):
+            shutil.copyfile(path, copy)
+        return copy
+
+    def pop(self, height: int, width: int, difficulty: str = None):
+        """
+        Take one ready puzzle, picked at random, out of the pool.
+        :param difficulty: only take a puzzle of this difficulty, None takes any
+        :return: the puzzle in the format of generate_puzzle(), None if there is none of that size
+        >>> pool = PuzzlePool(":memory:")
+        >>> puzzle = {"monster_nums": {"Z": 1, "V": 1, "G": 1}, "grid": [[0, 2], [0, 0]],
+        ...           "border_nums": {"top": [1, 0], "left": [1, 2], "bottom": [1, 2], "right": [0, 2]},
+        ...           "difficulty": "easy"}
+        >>> pool.push(2, 2, puzzle)
+        1
+        >>> pool.pop(2, 2, "hard"), pool.pop(2, 2, "easy") == puzzle, pool.pop(2, 2)
+        (None, True, None)
+        """
+        query, params = "SELECT id, data FROM puzzles WHERE height = ? AND width = ?", (height, width)
+        if difficulty is not None:
+            query, params = query + " AND difficulty = ?", params + (difficulty,)
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                # a random one: every instance starts from a copy of the same file, so taking them in order would
+                # hand out the same puzzles everywhere
+                row = self.conn.execute(query + " ORDER BY random() LIMIT 1", params).fetchone()
+                if row is not None:
+                    self.conn.execute("DELETE FROM puzzles WHERE id = ?", (row[0],))
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+        if row is None:
+            return None
+        puzzle = json.loads(row[1])
+        # pools filled by older versions stored the grid as floats
+        puzzle["grid"] = [[int(elem) for elem in grid_row] for grid_row in puzzle["grid"]]
+        return puzzle
+
+    def push(self, height: int, width: int, puzzle: dict) -> int:
+        return self.push_many(height, width, [puzzle])
+
+    def push_many(self, height: int, width: int, puzzles: list) -> int:
+        """
+        Add puzzles to the pool, leaving out the ones already in it in any orientation.
+        :return: the num of puzzles added
+        >>> from puzzleSymmetry import transform_puzzle
+        >>> puzzle = {"monster_nums": {"Z": 1, "V": 1, "G": 1}, "grid": [[0, 2], [0, 0]],
+        ...           "border_nums": {"top": [1, 0], "left": [1, 2], "bottom": [1, 2], "right": [0, 2]}}
+        >>> pool = PuzzlePool(":memory:")
+        >>> pool.push_many(2, 2, [puzzle, {}])
+        Traceback (most recent call last):
+        KeyError: 'grid'
+        >>> pool.size(2, 2), pool.push_many(2, 2, [puzzle, transform_puzzle(puzzle, (True, True, False))])
+        (0, 1)
+        """
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                cursor = self.conn.executemany(
+                    "INSERT OR IGNORE INTO puzzles (height, width, difficulty, canonical, data) VALUES (?, ?, ?, ?, ?)",
+                    ((height, width, puzzle.get("difficulty"), canonical_key(puzzle), json.dumps(puzzle))
+                     for puzzle in puzzles))
+            except BaseException:
+                # none of the batch, rather than the part of it before the error
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+        return cursor.rowcount
+
+    def size(self, height: int, width: int, difficulty: str = None) -> int:
+        query, params = "SELECT COUNT(*) FROM puzzles WHERE height = ? AND width = ?", (height, width)
+        if difficulty is not None:
+            query, params = query + " AND difficulty = ?", params + (difficulty,)
+        with self.lock:
+            return self.conn.execute(query, params).fetchone()[0]
+
+    def deficits(self) -> dict:
+        """
+        :return: (height, width) -> how many puzzles are missing to reach the target, only the sizes that miss some
+        """
+        missing = {}
+        for (height, width), target in self.targets.items():
+            num = target - self.size(height, width)
+            if num > 0:
+                missing[height, width] = num
+        return missing
+
+    def fill(self, sizes: list = None, batch: int = 10, progress=None, workers: int = 1) -> int:
+        """
+        Generate puzzles until every size reaches its target.
+        :param sizes: the (height, width) to fill, None means every size in targets
+        :param batch: puzzles generated between two writes to the store
+        :param progress: optional callback(height, width, num_in_pool)
+        :param workers: num of processes generating puzzles, 1 generates them in this process
+        :return: the num of puzzles added
+        """
+        added = 0
+        for (height, width), num in self.deficits().items():
+            if sizes is not None and (height, width) not in sizes:
+                continue
+            while num > 0:
+                if workers > 1:
+                    puzzles = generate_puzzles(min(batch * workers, num), height, width, workers)
+                else:
+                    puzzles = [generate_puzzle(height, width) for _ in range(min(batch, num))]
+                num_added = self.push_many(height, width, puzzles)
+                num -= num_added
+                added += num_added
+                if progress is not None:
+                    progress(height, width, self.size(height, width))
+                if not num_added:
+                    break  # a whole batch of duplicates, the size has run out of new puzzles
+        return added
+
+    def refill_in_background(self) -> None:
+        """
+        Start a daemon thread that tops the pool back up to its targets, unless one is already running.
+        """
+        with self.lock:
+            if self.refill_thread is not None and self.refill_thread.is_alive():
+                return
+            self.refill_thread = threading.Thread(target=self.fill, daemon=True)
+            self.refill_thread.start()
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+_pool = None
+
+
+def get_pool() -> PuzzlePool:
+    """
+    The pool shared by the API handlers, configured by the environment:
+    PUZZLE_POOL_PATH is the SQLite file and PUZZLE_POOL_TARGETS the per-size targets (like "5x5=200,6x6=100").
+    """
+    global _pool
+    if _pool is None:
+        targets = os.environ.get("PUZZLE_POOL_TARGETS")
+        _pool = PuzzlePool(os.environ.get("PUZZLE_POOL_PATH", DEFAULT_PATH),
+                           parse_targets(targets) if targets else None)
+    return _pool
+
+
+def main(argv: list = None) -> None:
+    import argparse  # only for the command line, the API imports this module too
+    parser = argparse.ArgumentParser(description="Manage the pool of pre-generated puzzles.")
+    parser.add_argument("--db", default=os.environ.get("PUZZLE_POOL_PATH", DEFAULT_PATH), help="SQLite file")
+    commands = parser.add_subparsers(dest="command", required=True)
+    fill = commands.add_parser("fill", help="generate puzzles until every size reaches its target")
+    fill.add_argument("--sizes", nargs="*", type=parse_size, help="sizes like 5x5, default every size in targets")
+    fill.add_argument("--target", type=int, help="the same target for every size given by --sizes")
+    fill.add_argument("--targets", type=parse_targets, help='per-size targets like "5x5=200,6x6=100"')
+    fill.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="num of generator processes")
+    commands.add_parser("status", help="show how many puzzles are ready for each size")
+    args = parser.parse_args(argv)
+
+    targets = dict(DEFAULT_TARGETS)
+    if args.command == "fill":
+        if args.targets:
+            targets.update(args.targets)
+        if args.sizes and args.target is not None:
+            targets.update({size: args.target for size in args.sizes})
+    pool = PuzzlePool(args.db, targets)
+    if args.command == "fill":
+        added = pool.fill(args.sizes, progress=lambda h, w, num: print(f"{h}x{w}: {num}"), workers=args.workers)
+        print(f"added {added} puzzles")
+    for (height, width), target in sorted(targets.items()):
+        print(f"{height}x{width}: {pool.size(height, width)}/{target}")
+    pool.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,318 @@
+"""
+The puzzle endpoint without the server around it, shared by the two ways to run it:
+api/generate_puzzle.py, the BaseHTTPRequestHandler that Vercel runs and that generates on the request thread, and
+puzzleAsgi, an ASGI app that generates in worker processes.
+
+    GET ?height=5&width=5&difficulty=easy&format=json&count=N&id=SEED
+
+Every request is parsed by parse_request(), and the answer is a Response: the status, the headers, and either the
+whole body or the chunks of a ?count= stream.
+"""
+
+import base64
+import hashlib
+import json
+import os
+import time
+from functools import lru_cache
+from urllib.parse import parse_qs, urlparse
+
+from mirrorMazeSolver import DIFFICULTIES, BudgetExhausted, SolveStats, generate_puzzle
+from puzzleCodec import pack_puzzle
+from puzzlePool import get_pool
+
+# List of allowed origins
+ALLOWED_ORIGINS = ['https://portfolio-eric-lin.vercel.app',
+                   'https://portfolio-eric-lin-git-dev-games-chuan-che-lins-projects.vercel.app',
+                   'http://localhost:3000']
+# the most puzzles one ?count= request may ask for
+MAX_COUNT = 100
+# the largest height and width, the search grows exponentially with the size so bigger ones can't be served in time
+MAX_SIDE = int(os.environ.get('PUZZLE_MAX_SIDE', 10))
+# the largest height and width generated on request, the bigger ones only come from the pool: even 8x8 runs out of
+# TIME_BUDGET for a good part of the seeds, and 9x9 and 10x10 for nearly all of them
+MAX_LIVE_SIDE = int(os.environ.get('PUZZLE_MAX_LIVE_SIDE', 7))
+# what generating one puzzle may cost before the request gives up on it, in seconds and in search nodes
+TIME_BUDGET = float(os.environ.get('PUZZLE_TIME_BUDGET', 5))
+NODE_BUDGET = int(os.environ['PUZZLE_NODE_BUDGET']) if os.environ.get('PUZZLE_NODE_BUDGET') else None
+# the seconds a whole ?count= stream may spend generating, shared by its puzzles
+STREAM_BUDGET = float(os.environ.get('PUZZLE_STREAM_BUDGET', TIME_BUDGET))
+# a puzzle asked for by ?id= never changes, so browsers and the CDN may keep it for good
+ID_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+# ?format= -> Content-Type of one puzzle, see puzzleCodec for the packed formats
+PACKED_TYPE = 'application/x-mirror-maze'
+FORMATS = {'json': 'application/json', 'packed': PACKED_TYPE, 'packed-base64': 'text/plain'}
+# Content-Type of ?count= batches, json and base64 send one puzzle per line, packed sends the frames back to back
+STREAM_TYPES = {'json': 'application/x-ndjson', 'packed': PACKED_TYPE, 'packed-base64': 'text/plain'}
+
+
+class Response:
+    """
+    What to send back. chunks is None for a whole body, else an iterable of the parts of a stream, which the server
+    sends as they come.
+    """
+
+    __slots__ = ("status", "headers", "body", "chunks")
+
+    def __init__(self, status: int, headers: list, body: bytes = b'', chunks=None):
+        self.status = status
+        self.headers = headers  # (name, value) pairs
+        self.body = body
+        self.chunks = chunks
+
+
+def body_response(status: int, body: bytes, content_type: str, cors_origin: str = None,
+                  server_timing: str = None) -> Response:
+    headers = [('Content-Type', content_type), ('Content-Length', str(len(body)))]
+    if server_timing:
+        headers.append(('Server-Timing', server_timing))
+    # Check if the origin is in our list of allowed origins
+    if cors_origin is not None:
+        headers.append(('Access-Control-Allow-Origin', cors_origin))
+    return Response(status, headers, body)
+
+
+def json_response(status: int, data: dict, cors_origin: str = None) -> Response:
+    return body_response(status, json.dumps(data).encode(), 'application/json', cors_origin)
+
+
+def cached_response(body: bytes, etag: str, content_type: str, cors_origin: str = None,
+                    if_none_match: str = None) -> Response:
+    """
+    A puzzle that never changes, or 304 when the client already has it.
+    >>> cached_response(b'{}', '"ab"', 'application/json', None, 'W/"x", "ab"').status
+    304
+    """
+    not_modified = if_none_match is not None and (
+        if_none_match.strip() == '*' or etag in (tag.strip() for tag in if_none_match.split(',')))
+    headers = [('ETag', etag), ('Cache-Control', ID_CACHE_CONTROL),
+               # the CORS header and the format depend on them, so shared caches keep a copy for each
+               ('Vary', 'Origin, Accept')]
+    if cors_origin is not None:
+        headers.append(('Access-Control-Allow-Origin', cors_origin))
+    if not_modified:
+        return Response(304, headers)
+    headers += [('Content-Type', content_type), ('Content-Length', str(len(body)))]
+    return Response(200, headers, body)
+
+
+def stream_response(chunks, fmt: str, cors_origin: str = None) -> Response:
+    headers = [('Content-Type', STREAM_TYPES[fmt])]
+    if cors_origin is not None:
+        headers.append(('Access-Control-Allow-Origin', cors_origin))
+    return Response(200, headers, chunks=chunks)
+
+
+def allowed_origin(origin: str = None):
+    """
+    :return: origin when it may read the response, else None
+    """
+    return origin if origin in ALLOWED_ORIGINS else None
+
+
+def parse_request(query: str, accept: str = None) -> dict:
+    """
+    :param query: the query string of the request
+    :param accept: its Accept header, ?format= wins over it
+    :return: height, width, difficulty, count (None for one puzzle), id (None for a random puzzle) and format
+    :raises ValueError: with the message for the client when a parameter is wrong
+    >>> parse_request('height=6&width=7&id=42', 'application/x-mirror-maze')
+    {'height': 6, 'width': 7, 'difficulty': None, 'count': None, 'id': 42, 'format': 'packed'}
+    >>> parse_request('height=60')
+    Traceback (most recent call last):
+    ...
+    ValueError: height and width should be between 2 and 10
+    >>> parse_request('height=9&width=9&id=42')
+    Traceback (most recent call last):
+    ...
+    ValueError: id needs height and width of at most 7
+    """
+    query_components = parse_qs(query)
+    height = query_components.get('height', ['5'])[0]
+    width = query_components.get('width', ['5'])[0]
+    if not (height.isdigit() and width.isdigit() and 2 <= int(height) <= MAX_SIDE and 2 <= int(width) <= MAX_SIDE):
+        raise ValueError(f"height and width should be between 2 and {MAX_SIDE}")
+    difficulty = query_components.get('difficulty', [None])[0]
+    if difficulty is not None and difficulty not in DIFFICULTIES:
+        raise ValueError(f"difficulty should be one of {', '.join(DIFFICULTIES)}")
+    count = query_components.get('count', [None])[0]
+    if count is not None and not (count.isdigit() and 1 <= int(count) <= MAX_COUNT):
+        raise ValueError(f"count should be between 1 and {MAX_COUNT}")
+    puzzle_id = query_components.get('id', [None])[0]
+    if puzzle_id is not None and not puzzle_id.isdigit():
+        raise ValueError("id should be a non-negative integer")
+    if puzzle_id is not None and count is not None:
+        raise ValueError("id and count can't be used together")
+    if puzzle_id is not None and max(int(height), int(width)) > MAX_LIVE_SIDE:
+        # the puzzle of an id has to be generated, the pool can't stand in for it
+        raise ValueError(f"id needs height and width of at most {MAX_LIVE_SIDE}")
+    fmt = query_components.get('format', [None])[0]
+    if fmt is None:
+        fmt = 'packed' if PACKED_TYPE in (accept or '') else 'json'
+    if fmt not in FORMATS:
+        raise ValueError(f"format should be one of {', '.join(FORMATS)}")
+    return {
+        'height': int(height),
+        'width': int(width),
+        'difficulty': difficulty,
+        'count': None if count is None else int(count),
+        'id': None if puzzle_id is None else int(puzzle_id),
+        'format': fmt,
+    }
+
+
+def time_budget(height: int, width: int) -> float:
+    """
+    :return: the seconds generating one puzzle of this size may take, 0 for the sizes only served from the pool
+    >>> time_budget(5, 5) == TIME_BUDGET, time_budget(7, 9)
+    (True, 0)
+    """
+    return TIME_BUDGET if max(height, width) <= MAX_LIVE_SIDE else 0
+
+
+def encode_puzzle(puzzle: dict, fmt: str = 'json') -> bytes:
+    if fmt == 'packed':
+        return pack_puzzle(puzzle)
+    if fmt == 'packed-base64':
+        return base64.b64encode(pack_puzzle(puzzle))
+    return json.dumps(puzzle).encode()
+
+
+def encode_chunk(puzzle: dict, fmt: str = 'json') -> bytes:
+    """
+    :return: the puzzle as one part of a ?count= stream
+    """
+    chunk = encode_puzzle(puzzle, fmt)
+    return chunk if fmt == 'packed' else chunk + b'\n'
+
+
+def error_chunk(exc: Exception, fmt: str = 'json'):
+    """
+    :param exc: why the stream ends early, BudgetExhausted or anything else with as_dict()
+    :return: the last line of the stream, None for the packed formats, which just end early
+    """
+    return json.dumps(exc.as_dict()).encode() + b'\n' if fmt == 'json' else None
+
+
+def id_body(puzzle: dict, fmt: str = 'json') -> tuple:
+    """
+    :return: the body of the puzzle of an ?id= in fmt, and its strong ETag
+    """
+    body = encode_puzzle(puzzle, fmt)
+    return body, '"%s"' % hashlib.sha256(body).hexdigest()[:32]
+
+
+@lru_cache(maxsize=256)
+def generate_by_id(height: int, width: int, seed: int, difficulty: str = None) -> dict:
+    """
+    The puzzle generated from seed, kept for the recently asked ids so the same link is only generated once per
+    process. The result is shared, don't change it.
+    """
+    return generate_puzzle(height, width, seed=seed, difficulty=difficulty, time_limit=time_budget(height, width),
+                           node_limit=NODE_BUDGET)
+
+
+@lru_cache(maxsize=256)
+def puzzle_by_id(height: int, width: int, seed: int, difficulty: str = None, fmt: str = 'json') -> tuple:
+    """
+    :return: see id_body()
+    """
+    return id_body(generate_by_id(height, width, seed, difficulty), fmt)
+
+
+def budget_fallback(pool, height: int, width: int, difficulty: str, exc: BudgetExhausted) -> dict:
+    """
+    When the budget of a graded puzzle runs out, a pooled puzzle of the same size but any difficulty is the best
+    effort, its own difficulty field tells which one it is.
+    :raises BudgetExhausted: exc, when there is no such puzzle either
+    """
+    puzzle_data = pool.pop(height, width) if difficulty is not None else None
+    if puzzle_data is None:
+        raise exc
+    return puzzle_data
+
+
+def generate(pool, height: int, width: int, difficulty: str = None, stats=None, deadline: float = None) -> dict:
+    """
+    Generate a puzzle within time_budget() and NODE_BUDGET, see budget_fallback() for when that fails.
+    :param deadline: time.time() to give up at when that comes before the end of time_budget(), None means no such time
+    """
+    time_limit = time_budget(height, width)
+    if deadline is not None:
+        time_limit = min(time_limit, deadline - time.time())
+    try:
+        return generate_puzzle(height, width, difficulty=difficulty, stats=stats, time_limit=time_limit,
+                               node_limit=NODE_BUDGET)
+    except BudgetExhausted as exc:
+        return budget_fallback(pool, height, width, difficulty, exc)
+
+
+def maybe_refill(pool) -> None:
+    if os.environ.get('PUZZLE_POOL_REFILL'):
+        pool.refill_in_background()
+
+
+def respond(path: str, headers) -> Response:
+    """
+    Answer one GET, generating on the calling thread.
+    :param headers: the request headers, anything with a case-insensitive get() like those of BaseHTTPRequestHandler
+    >>> response = respond('/api/generate_puzzle?height=0', {'Origin': 'http://localhost:3000'})
+    >>> response.status, ('Access-Control-Allow-Origin', 'http://localhost:3000') in response.headers
+    (400, True)
+    """
+    cors_origin = allowed_origin(headers.get('Origin'))
+    try:
+        params = parse_request(urlparse(path).query, headers.get('Accept'))
+    except ValueError as exc:
+        return json_response(400, {'error': str(exc)}, cors_origin)
+    height, width, difficulty, fmt = params['height'], params['width'], params['difficulty'], params['format']
+
+    if params['id'] is not None:
+        # the same id, size and difficulty always give the same puzzle, so it can be cached anywhere
+        try:
+            body, etag = puzzle_by_id(height, width, params['id'], difficulty, fmt)
+        except BudgetExhausted as exc:
+            # another puzzle wouldn't be the one the id stands for, and lru_cache doesn't keep the failure
+            return json_response(503, exc.as_dict(), cors_origin)
+        return cached_response(body, etag, FORMATS[fmt], cors_origin, headers.get('If-None-Match'))
+
+    # serve pre-generated puzzles when there are some, only generate on the spot when the pool has run dry
+    pool = get_pool()
+    maybe_refill(pool)
+    if params['count'] is not None:
+        return stream_response(stream_puzzles(pool, height, width, difficulty, params['count'], fmt,
+                                              time.time() + STREAM_BUDGET), fmt, cors_origin)
+    # the time of every phase goes out in the Server-Timing header, so traces show where it went
+    stats = SolveStats()
+    with stats.phase('pool'):
+        puzzle_data = pool.pop(height, width, difficulty)
+    if puzzle_data is None:
+        try:
+            with stats.phase('generate'):
+                puzzle_data = generate(pool, height, width, difficulty, stats)
+        except BudgetExhausted as exc:
+            return json_response(503, exc.as_dict(), cors_origin)
+    with stats.phase('encode'):
+        body = encode_puzzle(puzzle_data, fmt)
+    return body_response(200, body, FORMATS[fmt], cors_origin, stats.server_timing())
+
+
+def stream_puzzles(pool, height: int, width: int, difficulty: str, count: int, fmt: str = 'json',
+                   deadline: float = None):
+    """
+    Yield count puzzles one by one as soon as each is ready, so the first one goes out without waiting for the rest
+    and nothing but the current puzzle is held in memory. The status has gone out with the first chunk, so when the
+    budget runs out the stream ends early, see error_chunk().
+    :param deadline: time.time() after which no more puzzles are generated, only pooled ones are sent, see generate()
+    """
+    for _ in range(count):
+        puzzle_data = pool.pop(height, width, difficulty)
+        try:
+            if puzzle_data is None:
+                puzzle_data = generate(pool, height, width, difficulty, deadline=deadline)
+        except BudgetExhausted as exc:
+            chunk = error_chunk(exc, fmt)
+            if chunk is not None:
+                yield chunk
+            return
+        yield encode_chunk(puzzle_data, fmt)
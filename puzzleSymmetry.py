@@ -0,0 +1,183 @@
+"""
+Symmetries of puzzles, so equivalent puzzles can be told apart from new ones.
+
+Turning a puzzle or mirroring it gives the same puzzle in another orientation: the mirrors "/" and "\\" trade places
+when the grid is flipped, the border numbers move with their sides, and the monster totals stay the same. A square
+grid has the 8 symmetries of the square, any other grid the 4 that keep its height and width. A symmetry is the tuple
+(transpose, flip_rows, flip_cols), applied in that order.
+
+The canonical form of a puzzle is its smallest orientation (by grid, then border numbers), and the canonical key is a
+hash of it, the same for every orientation. PuzzleIndex keeps the keys of the puzzles seen so far.
+"""
+
+import hashlib
+import struct
+from functools import lru_cache
+
+SIDES = ("top", "left", "bottom", "right")
+_TRANSPOSED = {"top": "left", "left": "top", "bottom": "right", "right": "bottom"}
+_SWAPPED = {1: 2, 2: 1, "/": "\\", "\\": "/"}
+
+
+def symmetries(height: int, width: int) -> list:
+    """
+    >>> len(symmetries(5, 5)), symmetries(4, 6)
+    (8, [(False, False, False), (False, False, True), (False, True, False), (False, True, True)])
+    """
+    return [(transpose, flip_rows, flip_cols) for transpose in ((False, True) if height == width else (False,))
+            for flip_rows in (False, True) for flip_cols in (False, True)]
+
+
+@lru_cache(maxsize=256)
+def _maps(height: int, width: int, symmetry: tuple) -> tuple:
+    """
+    :return: the new height and width, and where every cell and every border number of the new grid comes from, as
+        flat indexes into the old grid and the old border numbers (in the order of SIDES)
+    """
+    transpose, flip_rows, flip_cols = symmetry
+    new_height, new_width = (width, height) if transpose else (height, width)
+    cells = []
+    for x in range(new_height):
+        for y in range(new_width):
+            x0 = new_height - 1 - x if flip_rows else x
+            y0 = new_width - 1 - y if flip_cols else y
+            cells.append(y0 * width + x0 if transpose else x0 * width + y0)
+    offsets = {"top": 0, "left": width, "bottom": width + height, "right": 2 * width + height}
+    border = []
+    for side in SIDES:
+        for k in range(new_width if side in ("top", "bottom") else new_height):
+            # a row flip trades the top and the bottom and reverses the left and the right side, a column flip the
+            # other way around, and the transpose trades every side with its neighbour
+            source, index = side, k
+            if flip_rows:
+                source = {"top": "bottom", "bottom": "top"}.get(source, source)
+                index = index if source in ("top", "bottom") else new_height - 1 - index
+            if flip_cols:
+                source = {"left": "right", "right": "left"}.get(source, source)
+                index = index if source in ("left", "right") else new_width - 1 - index
+            if transpose:
+                source = _TRANSPOSED[source]
+            border.append(offsets[source] + index)
+    return new_height, new_width, cells, border
+
+
+def _flat(puzzle: dict) -> tuple:
+    grid = puzzle["grid"]
+    cells = [int(elem) for row in grid for elem in row]
+    border = [num for side in SIDES for num in puzzle["border_nums"][side]]
+    return len(grid), len(grid[0]), cells, border
+
+
+def _apply(maps: tuple, symmetry: tuple, cells: list, border: list = ()) -> tuple:
+    new_cells = [cells[k] for k in maps[2]]
+    if symmetry[1] != symmetry[2]:
+        # one flip turns "/" into "\\", two flips (a half turn) keep them
+        new_cells = [_SWAPPED.get(elem, elem) for elem in new_cells]
+    return new_cells, [border[k] for k in maps[3]] if border else []
+
+
+def transform_puzzle(puzzle: dict, symmetry: tuple) -> dict:
+    """
+    :param puzzle: in the format of mirrorMazeSolver.generate_puzzle(), the solution is optional
+    :param symmetry: one of symmetries()
+    :return: a new puzzle, the same one in another orientation
+    >>> from mirrorMazeSolver import MirrorMazeSolver
+    >>> def clues(grid, solution):
+    ...     return MirrorMazeSolver({"Z": 0, "V": 0, "G": 0}, grid, None, solution).border_nums
+    >>> solution = [["G", "\\\\", "V"], ["Z", "V", "/"]]
+    >>> puzzle = {"monster_nums": {"Z": 1, "V": 2, "G": 1}, "grid": [[0, 2, 0], [0, 0, 1]],
+    ...           "border_nums": clues([[0, 2, 0], [0, 0, 1]], solution), "solution": solution}
+    >>> turned = transform_puzzle(puzzle, (False, True, True))
+    >>> turned["grid"], turned["solution"]
+    ([[1, 0, 0], [0, 2, 0]], [['/', 'V', 'Z'], ['V', '\\\\', 'G']])
+    >>> all(clues(moved["grid"], moved["solution"]) == moved["border_nums"]
+    ...     for moved in (transform_puzzle(puzzle, symmetry) for symmetry in symmetries(2, 3)))
+    True
+    """
+    height, width, cells, border = _flat(puzzle)
+    maps = _maps(height, width, symmetry)
+    new_height, new_width = maps[:2]
+    new_cells, new_border = _apply(maps, symmetry, cells, border)
+    moved = dict(puzzle)
+    moved["grid"] = [new_cells[x * new_width:(x + 1) * new_width] for x in range(new_height)]
+    moved["border_nums"] = _split_border(new_border, new_height, new_width)
+    moved["monster_nums"] = dict(puzzle["monster_nums"])
+    if puzzle.get("solution") is not None:
+        solution, _ = _apply(maps, symmetry, [elem for row in puzzle["solution"] for elem in row])
+        moved["solution"] = [solution[x * new_width:(x + 1) * new_width] for x in range(new_height)]
+    return moved
+
+
+def _split_border(border: list, height: int, width: int) -> dict:
+    return {
+        "top": border[:width],
+        "left": border[width:width + height],
+        "bottom": border[width + height:2 * width + height],
+        "right": border[2 * width + height:],
+    }
+
+
+def _canonical_symmetry(height: int, width: int, cells: list, border: list) -> tuple:
+    best = None
+    for symmetry in symmetries(height, width):
+        candidate = _apply(_maps(height, width, symmetry), symmetry, cells, border)
+        if best is None or candidate < best[0]:
+            best = candidate, symmetry
+    return best
+
+
+def canonical_form(puzzle: dict) -> dict:
+    """
+    :return: the orientation of puzzle that is the same for all of its orientations, see transform_puzzle()
+    """
+    height, width, cells, border = _flat(puzzle)
+    return transform_puzzle(puzzle, _canonical_symmetry(height, width, cells, border)[1])
+
+
+def canonical_key(puzzle: dict) -> str:
+    """
+    :param puzzle: needs the grid, border_nums and monster_nums, the solution (which the clues decide) is left out
+    :return: a hash of the canonical form, equal for two puzzles exactly when one is an orientation of the other
+    >>> puzzle = {"monster_nums": {"Z": 1, "V": 1, "G": 1}, "grid": [[0, 2], [0, 0]],
+    ...           "border_nums": {"top": [1, 0], "left": [1, 2], "bottom": [1, 2], "right": [0, 2]}}
+    >>> len({canonical_key(transform_puzzle(puzzle, symmetry)) for symmetry in symmetries(2, 2)})
+    1
+    >>> canonical_key(puzzle) == canonical_key(dict(puzzle, monster_nums={"Z": 0, "V": 1, "G": 2}))
+    False
+    """
+    height, width, cells, border = _flat(puzzle)
+    (new_cells, new_border), _ = _canonical_symmetry(height, width, cells, border)
+    nums = puzzle["monster_nums"]
+    data = (struct.pack(">BBHHH", height, width, nums["Z"], nums["V"], nums["G"]) +
+            bytes(new_cells) + struct.pack(f">{len(new_border)}H", *new_border))
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+class PuzzleIndex:
+    """
+    The canonical keys of the puzzles seen so far, so a new puzzle is checked against all of them in O(1).
+    >>> index = PuzzleIndex()
+    >>> puzzle = {"monster_nums": {"Z": 1, "V": 1, "G": 1}, "grid": [[0, 2], [0, 0]],
+    ...           "border_nums": {"top": [1, 0], "left": [1, 2], "bottom": [1, 2], "right": [0, 2]}}
+    >>> index.add(puzzle), index.add(transform_puzzle(puzzle, (True, False, True))), len(index)
+    (True, False, 1)
+    """
+
+    def __init__(self, keys=()):
+        self.keys = set(keys)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def __contains__(self, puzzle: dict) -> bool:
+        return canonical_key(puzzle) in self.keys
+
+    def add(self, puzzle: dict) -> bool:
+        """
+        :return: True when the puzzle is new, False when it (or an orientation of it) was added before
+        """
+        key = canonical_key(puzzle)
+        if key in self.keys:
+            return False
+        self.keys.add(key)
+        return True
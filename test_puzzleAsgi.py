@@ -0,0 +1,107 @@
+"""
+Drive puzzleAsgi.app in process, without an ASGI server:
+
+    python -m unittest test_puzzleAsgi
+"""
+
+import asyncio
+import unittest
+from unittest import mock
+
+import puzzleAsgi
+import puzzleService
+
+# big and hard enough that generating it takes longer than the tests wait, with the size generated on request
+SLOW = 'height=10&width=10&difficulty=hard&id=%d'
+
+
+async def call(query: str, disconnect_after: float = None) -> tuple:
+    """
+    Send one GET to the app.
+    :param disconnect_after: seconds after which the client disconnects, None keeps it waiting for the answer
+    :return: the status (None when nothing was sent), the headers by their lowercase names, and the body
+    """
+    scope = {'type': 'http', 'method': 'GET', 'query_string': query.encode(), 'headers': []}
+    messages = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+    sent = []
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        if disconnect_after is None:
+            await asyncio.Event().wait()
+        await asyncio.sleep(disconnect_after)
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        sent.append(message)
+
+    await puzzleAsgi.app(scope, receive, send)
+    if not sent:
+        return None, {}, b''
+    headers = {name.decode(): value.decode() for name, value in sent[0]['headers']}
+    return sent[0]['status'], headers, b''.join(message.get('body', b'') for message in sent[1:])
+
+
+class AsgiTest(unittest.TestCase):
+
+    def setUp(self):
+        patch = mock.patch.object(puzzleService, 'MAX_LIVE_SIDE', 10)
+        patch.start()
+        self.addCleanup(patch.stop)
+        puzzleAsgi._generator = self.generator = puzzleAsgi.Generator(workers=2, max_pending=2)
+
+    def tearDown(self):
+        self.generator.close()
+        puzzleAsgi._generator = None
+
+    def run_async(self, coroutine):
+        async def settled():
+            try:
+                return await coroutine
+            finally:
+                # the slots are given back on the loop, keep it open until the workers are done with them
+                for _ in range(200):
+                    if len(self.generator.free) == 2:
+                        break
+                    await asyncio.sleep(0.01)
+
+        return asyncio.run(settled())
+
+    def test_identical_ids_share_one_generation(self):
+        submit = self.generator.executor.submit
+        submitted = []
+        self.generator.executor.submit = lambda *args: submitted.append(args) or submit(*args)
+
+        async def requests():
+            return await asyncio.gather(*[call('height=5&width=5&id=7') for _ in range(3)])
+
+        responses = self.run_async(requests())
+        self.assertEqual([status for status, _, _ in responses], [200] * 3)
+        self.assertEqual(len({headers['etag'] for _, headers, _ in responses}), 1)
+        self.assertEqual(len(submitted), 1)
+
+    def test_busy_when_every_slot_is_pending(self):
+        async def requests():
+            # the first two take both slots, the client of the third gets its answer at once
+            slow = [asyncio.ensure_future(call(SLOW % seed, disconnect_after=0.5)) for seed in (1, 2)]
+            await asyncio.sleep(0.1)
+            third = await call(SLOW % 3)
+            await asyncio.gather(*slow)
+            return third
+
+        status, headers, body = self.run_async(requests())
+        self.assertEqual(status, 503)
+        self.assertEqual(headers['retry-after'], '1')
+        self.assertIn(b'busy', body)
+
+    def test_disconnect_cancels_the_generation(self):
+        status, _, _ = self.run_async(call(SLOW % 4, disconnect_after=0.2))
+        self.assertIsNone(status)
+        # the worker stopped at its next dead end and gave the slot back
+        self.assertEqual(len(self.generator.free), 2)
+        self.assertEqual(self.generator.in_flight, {})
+
+
+if __name__ == '__main__':
+    unittest.main()